@@ -1,5 +1,14 @@
+import os
+
 from flask import Flask
 
 app = Flask(__name__)
 
 from app import routes
+
+# Set by gunicorn.conf.py so that the master process loads data before forking workers.
+if os.environ.get("FLOWER_PRELOAD"):
+    routes.preload()
+# Serve every valid /results query from memory.
+if os.environ.get("FLOWER_WARM_CACHE"):
+    routes.warm_cache()
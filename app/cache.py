@@ -0,0 +1,124 @@
+import hashlib
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import *
+
+
+class LRUCache:
+    """
+    Thread-safe bounded LRU cache with hit / miss counters.
+
+    Entries are bounded in number (`maxsize`) and, when `sizeof` is given, in total size
+    (`maxbytes`). Concurrent misses of the same key are coalesced: only the first caller
+    computes the value, the others wait for it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int = 256,
+        maxbytes: Optional[int] = None,
+        sizeof: Optional[Callable[[Any], int]] = None,
+    ):
+        self.name = name
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.nbytes = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._pending: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._data:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return self._data[key]
+
+            pending = self._pending.get(key)
+            if pending is not None:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                self._pending[key] = Future()
+
+        if pending is not None:
+            # Raises the exception of the computing caller, if any.
+            return pending.result()
+
+        # Computed outside of the lock, other keys are still served meanwhile.
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                self._pending.pop(key).set_exception(e)
+            raise
+
+        size = self.sizeof(value) if self.sizeof else 0
+        with self._lock:
+            self._data[key] = value
+            self._sizes[key] = size
+            self.nbytes += size
+            while self._data and (
+                len(self._data) > self.maxsize or (self.maxbytes is not None and self.nbytes > self.maxbytes)
+            ):
+                evicted, _ = self._data.popitem(last=False)
+                self.nbytes -= self._sizes.pop(evicted)
+            self._pending.pop(key).set_result(value)
+        return value
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "bytes": self.nbytes,
+        }
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    mimetype: str
+
+
+def cached_response(body: Union[str, bytes], mimetype: str) -> CachedResponse:
+    if isinstance(body, str):
+        body = body.encode()
+    return CachedResponse(body, hashlib.sha1(body).hexdigest(), mimetype)
+
+
+def prometheus_metrics(caches: Iterable[LRUCache]) -> str:
+    """
+    Cache counters in Prometheus text exposition format.
+    """
+    lines = []
+    for metric, kind in [
+        ("hits", "counter"),
+        ("misses", "counter"),
+        ("coalesced", "counter"),
+        ("size", "gauge"),
+        ("bytes", "gauge"),
+    ]:
+        lines.append(f"# TYPE flower_cache_{metric} {kind}")
+        for cache in caches:
+            lines.append(f'flower_cache_{metric}{{cache="{cache.name}"}} {cache.stats()[metric]}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import *
+
+
+class JobQueue:
+    """
+    Background jobs run on a process pool, with results persisted to SQLite.
+
+    A job is a registered handler called with json arguments. Its id is derived from its
+    key, so identical jobs share one id: a job already running or done is never submitted
+    again, a failed one is retried when submitted again. Finished jobs survive restarts. Pending jobs record the pid of the process running
+    them and are submitted again when that process is gone, e.g. after a worker restart.
+    A pool broken by a dead worker process (OOM kill, crash) fails its jobs and is replaced.
+    """
+
+    def __init__(self, db_file: str, handlers: Dict[str, Callable[..., Any]], workers: Optional[int] = None):
+        self.db_file = db_file
+        self.handlers = handlers
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_pid: Optional[int] = None
+        self._running: Dict[str, Future] = {}
+        # Reentrant: the callback of a job which is already done runs in `submit`.
+        self._lock = threading.RLock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, kind TEXT, args TEXT, status TEXT, owner INTEGER,"
+                " result TEXT, error TEXT, created REAL, finished REAL)"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # One short lived connection per operation: safe across threads and forked workers.
+        db = sqlite3.connect(self.db_file, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # Created on first use, in the process that uses it (not in a gunicorn master before fork).
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            self._pool_pid = os.getpid()
+            self._running.clear()
+        return self._pool
+
+    @staticmethod
+    def job_id(key: Any) -> str:
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:20]
+
+    def submit(self, key: Any, kind: str, args: Dict[str, Any]) -> str:
+        """
+        Id of the job identified by `key`, submitted unless it is already running or done.
+        """
+        job_id = self.job_id(key)
+        with self._lock:
+            row = self._row(job_id)
+            if (row is None or row["status"] == "failed" or self._lost(row)) and self._claim(job_id, kind, args, row):
+                self._run(job_id, kind, args)
+        return job_id
+
+    def _row(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as db:
+            db.row_factory = sqlite3.Row
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return None if row is None else dict(row)
+
+    def _lost(self, row: Dict[str, Any]) -> bool:
+        """
+        Pending job whose process is gone.
+        """
+        if row["status"] != "pending":
+            return False
+        if row["owner"] == os.getpid():
+            return row["id"] not in self._running
+        try:
+            os.kill(row["owner"], 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    def _claim(self, job_id: str, kind: str, args: Dict[str, Any], row: Optional[Dict[str, Any]]) -> bool:
+        """
+        Record this process as the owner of a new, failed or lost job. False when another worker was first.
+        """
+        with self._connect() as db:
+            if row is None:
+                cursor = db.execute(
+                    "INSERT OR IGNORE INTO jobs (id, kind, args, status, owner, created)"
+                    " VALUES (?, ?, ?, 'pending', ?, ?)",
+                    (job_id, kind, json.dumps(args), os.getpid(), time.time()),
+                )
+            elif row["status"] == "failed":
+                cursor = db.execute(
+                    "UPDATE jobs SET status = 'pending', owner = ?, error = NULL, finished = NULL, created = ?"
+                    " WHERE id = ? AND status = 'failed' AND finished = ?",
+                    (os.getpid(), time.time(), job_id, row["finished"]),
+                )
+            else:
+                cursor = db.execute(
+                    "UPDATE jobs SET owner = ? WHERE id = ? AND status = 'pending' AND owner = ?",
+                    (os.getpid(), job_id, row["owner"]),
+                )
+        return cursor.rowcount == 1
+
+    def _run(self, job_id: str, kind: str, args: Dict[str, Any]):
+        """
+        Submit a claimed job to the pool, replacing a broken pool once. The job is marked failed
+        when it cannot be submitted.
+        """
+        try:
+            try:
+                future = self._executor().submit(self.handlers[kind], **args)
+            except BrokenProcessPool:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+                future = self._executor().submit(self.handlers[kind], **args)
+        except Exception as e:
+            self._record(job_id, None, str(e) or type(e).__name__)
+            return
+        self._running[job_id] = future
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+
+    def _finish(self, job_id: str, future: Future):
+        try:
+            result, error = json.dumps(future.result()), None
+        except Exception as e:
+            result, error = None, str(e) or type(e).__name__
+        self._record(job_id, result, error)
+        with self._lock:
+            self._running.pop(job_id, None)
+
+    def _record(self, job_id: str, result: Optional[str], error: Optional[str]):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ? WHERE id = ?",
+                ("failed" if error is not None else "done", result, error, time.time(), job_id),
+            )
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        {"id", "status": "pending" | "done" | "failed", "error", "created", "finished"},
+        None for an unknown job. Lost jobs are submitted again.
+        """
+        with self._lock:
+            row = self._row(job_id)
+            if row is not None and self._lost(row):
+                args = json.loads(row["args"])
+                if self._claim(job_id, row["kind"], args, row):
+                    self._run(job_id, row["kind"], args)
+                row = self._row(job_id)
+        if row is None:
+            return None
+        return {k: row[k] for k in ("id", "status", "error", "created", "finished")}
+
+    def result(self, job_id: str) -> Any:
+        """
+        Result of a finished job (KeyError when it is not done).
+        """
+        row = self._row(job_id)
+        if row is None or row["status"] != "done":
+            raise KeyError(job_id)
+        return json.loads(row["result"])
+
+    def stats(self) -> Dict[str, int]:
+        with self._connect() as db:
+            counts = dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        with self._lock:
+            running = len(self._running)
+        res = {status: counts.get(status, 0) for status in ("pending", "done", "failed")}
+        res["running"] = running
+        return res
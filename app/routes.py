@@ -1,12 +1,47 @@
 import json
 import math
+import re
+import threading
 
-from flask import render_template, request
+from os import path
+from typing import *
+
+from flask import jsonify, make_response, render_template, request
 
 from app import app
+from app.cache import CachedResponse, LRUCache, cached_response, prometheus_metrics
+from app.jobs import JobQueue
 from flower import main
 
-app.flower_db = main.get_flowerpedia_db()
+app.flower_db = None
+_flower_db_lock = threading.Lock()
+
+
+def get_flower_db():
+    """
+    FlowerPedia DB, opened on first request rather than at import.
+    """
+    if app.flower_db is None:
+        with _flower_db_lock:
+            if app.flower_db is None:
+                app.flower_db = main.get_flowerpedia_db()
+    return app.flower_db
+
+
+def preload():
+    """
+    Load everything requests need up front, e.g. in the gunicorn master before fork
+    so that workers share these pages copy-on-write.
+    """
+    from flower import genetics, genotype
+
+    main.get_flower_info()
+    flower_db = get_flower_db()
+    for key in flower_db:
+        flower_db[key]
+    for flower_type in main.Flower.flowertypes:
+        genotype.species(flower_type)
+        genetics.genetics(flower_type).tables
 
 
 @app.route("/", methods=["GET"])
@@ -26,37 +61,172 @@ def form_page():
     )
 
 
-@app.route("/results", methods=["POST"])
-def result_page():
-    form = request.form
+# Target type, target color, seed, island, bitset of the other owned genotypes, number of ranked plans.
+ResultKey = Tuple[main.FlowerType, main.FlowerColor, bool, bool, int, int]
+
+MAX_PLANS = 10
+
+results_cache = LRUCache("results_html", maxsize=app.config.get("RESULTS_CACHE_SIZE", 256))
+plans_cache = LRUCache("results_json", maxsize=app.config.get("RESULTS_CACHE_SIZE", 256))
+# Explorations of custom inventories, keyed on (flower type, genotypes bitset).
+inventory_cache = LRUCache(
+    "inventory",
+    maxsize=app.config.get("INVENTORY_CACHE_SIZE", 4096),
+    maxbytes=app.config.get("INVENTORY_CACHE_BYTES", 64 * 2 ** 20),
+    sizeof=lambda pedia: pedia.nbytes(),
+)
+# Top-k explorations, keyed on (flower type, base genotypes, k).
+ranked_cache = LRUCache(
+    "ranked",
+    maxsize=app.config.get("INVENTORY_CACHE_SIZE", 4096),
+    maxbytes=app.config.get("INVENTORY_CACHE_BYTES", 64 * 2 ** 20),
+    sizeof=lambda ranked: ranked.nbytes(),
+)
+
+
+class PlanError(Exception):
+    pass
+
+
+def parse_flower(flower_type: main.FlowerType, code: Any) -> main.Flower:
+    """
+    Known flower from a gene code: "RR yy WW ss" or a list of genes.
+    """
+    try:
+        genes = main.read_code(code) if isinstance(code, str) else tuple(code)
+    except TypeError:
+        raise PlanError(f"Invalid gene code {code!r}")
+    if len(genes) != len(main.gene_layout(flower_type)) or any(
+        type(g) is not int or not 0 <= g <= 2 for g in genes
+    ):
+        raise PlanError(f"Invalid gene code {code!r}")
+    flower = main.Flower(flower_type, genes)
+    if flower not in main.get_flower_info():
+        raise PlanError(f"Invalid gene code {code!r}")
+    return flower
+
+
+def owned_mask(flower_type: main.FlowerType, codes: Iterable[Any]) -> int:
+    """
+    Canonical key of an inventory: bitset of its genotypes, whatever the order or duplicates.
+    """
+    from flower import genotype
+
+    sp = genotype.species(flower_type)
+    mask = 0
+    for code in codes:
+        mask |= 1 << sp.index(parse_flower(flower_type, code))
+    return mask
+
+
+def owned_codes(flower_type: main.FlowerType, owned: int) -> List[str]:
+    from flower import genotype
+
+    sp = genotype.species(flower_type)
+    return [sp.flower(g).code for g in genotype.iter_bits(owned)]
+
+
+def base_genotypes(flower_type: main.FlowerType, seed: bool, island: bool, owned: int) -> Tuple[bool, List[int]]:
+    """
+    Base genotypes of the seed and / or island flowers plus the `owned` ones, in exploration order,
+    and whether they are the ones of the (type, seed, island) DB partition. Custom inventories are
+    explored in increasing genotype order.
+    """
+    from flower import genotype
+
+    if not (seed or island or owned):
+        raise PlanError("At least one of seed, island or owned flowers is needed")
+
+    sp = genotype.species(flower_type)
+    base: List[int] = []
+    mask = 0
+    if seed or island:
+        base = [sp.index(f) for f in main.partition_base_flowers((flower_type, seed, island))]
+        for f in base:
+            mask |= 1 << f
+        if owned & ~mask == 0:
+            return True, base
+
+    return False, list(genotype.iter_bits(mask | owned))
+
+
+def get_flowerpedia(
+    flower_type: main.FlowerType, seed: bool, island: bool, owned: int = 0
+) -> Mapping[main.Flower, main.AncestorInfo]:
+    """
+    FlowerPedia of the seed and / or island flowers plus the `owned` genotypes.
+    Read from the DB when `owned` adds no new flower.
+    """
+    from flower import genotype
+
+    from_db, base = base_genotypes(flower_type, seed, island, owned)
+    if from_db:
+        return get_flower_db()[(flower_type, seed, island)]
+
+    sp = genotype.species(flower_type)
+    mask = sum(1 << f for f in base)
+    pedia = inventory_cache.get_or_compute((flower_type, mask), lambda: genotype.explore_indices(sp, base))
+    return pedia.view()
+
+
+def ranked_plans(target: main.Flower, seed: bool, island: bool, owned: int, k: int) -> List[Dict[str, Any]]:
+    """
+    Up to `k` plans of `target` by decreasing probability, each with a different last cross.
+    The first one is the plan of `get_flowerpedia`.
+    """
+    from flower import genotype
+
+    _, base = base_genotypes(target.type, seed, island, owned)
+    sp = genotype.species(target.type)
+    ranked = ranked_cache.get_or_compute(
+        (target.type, tuple(base), k), lambda: genotype.explore_top_k(sp, base, k)
+    )
+
+    f = sp.index(target)
+    return [
+        {
+            "total_prob": e.total,
+            "parents": None if e.parents is None else tuple(sp.flower(p) for p in e.parents),
+            "plan": plan,
+            "crosses": sum(1 for _, parents, *_ in plan.steps if parents),
+        }
+        for rank, e in enumerate(ranked.plans(f))
+        for plan in [main.build_plan(target, ranked.flowerpedia(f, rank))]
+    ]
+
+
+def ranked_plans_json(alternatives: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "total_prob": alt["total_prob"],
+            "parents": None if alt["parents"] is None else [p.code for p in alt["parents"]],
+            "graph": alt["plan"].graph,
+            "steps": steps_json(alt["plan"].steps, alt["plan"].names),
+            "names": alt["plan"].names,
+        }
+        for alt in alternatives
+    ]
+
 
-    tgt_type = getattr(main.Flower, form["tgt_type"])
-    tgt_color = getattr(main.Flower, form["tgt_color"])
-    seed = True if "seed" in form else False
-    island = True if "island" in form else False
+def compute_plan(key: ResultKey) -> Dict[str, Any]:
+    """
+    Best breeding plan for a target type and color.
+    Raises PlanError when no such flower exists or none can be obtained.
+    """
+    tgt_type, tgt_color, seed, island, owned, k = key
 
     tgt = main.uget(main.flower_info, _type=tgt_type, _color=tgt_color)
     if len(tgt) == 0:
-        return "This target does not exist"
+        raise PlanError("This target does not exist")
 
-    flowerpedia = app.flower_db[(tgt_type, seed, island)]
+    flowerpedia = get_flowerpedia(tgt_type, seed, island, owned)
     best_flower = max(
         tgt, key=lambda x: flowerpedia[x].total_prob if x in flowerpedia else -math.inf
     )
+    if best_flower not in flowerpedia:
+        raise PlanError("This target cannot be obtained from these flowers")
 
-    path = main.ancestors(best_flower, flowerpedia)
-
-    res, name = main.stepify(best_flower, path)
-    # base flowers in result / steps
-    base_flowers_needed = [f for f, a, p, t in res if len(a) == 0]
-    # base flowers appearing in tests
-    base_flowers_needed.extend(
-        test_f 
-        for *_, t in res
-        if t
-        and (test_f := main.Flower(tgt_type, main.read_code(t["test_flower_code"]))) not in base_flowers_needed
-        and test_f not in (f for f, a, *_ in res if len(a) > 0)
-    )
+    plan = main.build_plan(best_flower, flowerpedia)
 
     tn = 0
     hybrid_flowers = [
@@ -67,25 +237,486 @@ def result_page():
             t,
             (tn := tn + 1 if t else 0),
         )
-        for f, a, p, t in res
+        for f, a, p, t in plan.steps
         if len(a) > 0
     ]
 
-    test_keys = "unknown_flower_code unknown_flower_color test_flower_code test_flower_color test_prob test_color".split()
-    tests = [[t[k] for k in test_keys] for *_, t in res if t]
+    return {
+        "target": best_flower,
+        "steps": plan.steps,
+        "base_flowers": plan.base_flowers,
+        "hybrid_flowers": hybrid_flowers,
+        "names": plan.names,
+        "tests": plan.tests,
+        "graph": plan.graph,
+        "alternatives": ranked_plans(best_flower, seed, island, owned, k) if k > 1 else [],
+    }
 
-    return render_template(
-        "results.html",
-        base_flowers=base_flowers_needed,
-        hybrid_flowers=hybrid_flowers,
-        names=name,
-        tests=tests,
-        graph=path,
-        len=len,
-        enumerate=enumerate,
+
+def render_results(key: ResultKey) -> CachedResponse:
+    """
+    Raises PlanError, errors are not cached.
+    """
+    plan = compute_plan(key)
+
+    return cached_response(
+        render_template(
+            "results.html",
+            base_flowers=plan["base_flowers"],
+            hybrid_flowers=plan["hybrid_flowers"],
+            names=plan["names"],
+            tests=plan["tests"],
+            graph=plan["graph"],
+            alternatives=plan["alternatives"],
+            len=len,
+            enumerate=enumerate,
+        ),
+        "text/html",
+    )
+
+
+def render_plan_json(key: ResultKey) -> CachedResponse:
+    tgt_type, tgt_color, seed, island, owned, k = key
+    plan = compute_plan(key)
+
+    return cached_response(
+        json.dumps(
+            {
+                "type": tgt_type.strip("_").capitalize(),
+                "color": tgt_color,
+                "seed": seed,
+                "island": island,
+                "owned": owned_codes(tgt_type, owned),
+                "target": plan["target"].code,
+                "graph": plan["graph"],
+                "steps": steps_json(plan["steps"], plan["names"]),
+                "names": plan["names"],
+                "alternatives": ranked_plans_json(plan["alternatives"]),
+            }
+        ),
+        "application/json",
+    )
+
+
+def steps_json(steps, names: Dict[str, str]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "name": names[f.code],
+            "code": f.code,
+            "color": f.color,
+            "parents": [names[p.code] for p in a],
+            "prob": float(p),
+            "test": t,
+        }
+        for f, a, p, t in steps
+    ]
+
+
+def plans_count(value: Any) -> int:
+    try:
+        k = int(value)
+    except (TypeError, ValueError):
+        raise PlanError(f"Invalid number of plans {value!r}")
+    if not 1 <= k <= MAX_PLANS:
+        raise PlanError(f"The number of plans must be between 1 and {MAX_PLANS}")
+    return k
+
+
+def result_key(form) -> ResultKey:
+    tgt_type = flower_type(form.get("tgt_type"))
+    # Other owned flowers: gene codes separated by commas or new lines, in one or more `owned` fields.
+    codes = [code for value in form.getlist("owned") for code in re.split(r"[,\n]", value) if code.strip()]
+    return (
+        tgt_type,
+        flower_color(form.get("tgt_color")),
+        True if "seed" in form else False,
+        True if "island" in form else False,
+        owned_mask(tgt_type, codes),
+        plans_count(form.get("plans", 1)),
     )
 
 
+def send_cached(cached: CachedResponse):
+    response = make_response(cached.body)
+    response.mimetype = cached.mimetype
+    response.set_etag(cached.etag)
+    return response.make_conditional(request)
+
+
+@app.route("/results", methods=["GET", "POST"])
+def result_page():
+    """
+    Breeding plan as an html page, or as json when the client prefers `application/json`.
+    GET requests get `304 Not Modified` answers for a known ETag.
+    """
+    wants_json = request.accept_mimetypes.best_match(["text/html", "application/json"]) == "application/json"
+    try:
+        key = result_key(request.values)
+        if wants_json:
+            return send_cached(plans_cache.get_or_compute(key, lambda: render_plan_json(key)))
+        return send_cached(results_cache.get_or_compute(key, lambda: render_results(key)))
+    except PlanError as e:
+        return (jsonify(error=str(e)) if wants_json else str(e)), 400
+
+
+def result_keys() -> Iterator[ResultKey]:
+    for flower_type in main.Flower.flowertypes:
+        for color in main.Flower.flowercolors:
+            for seed, island in [(True, False), (False, True), (True, True)]:
+                yield flower_type, color, seed, island, 0, 1
+
+
+def warm_cache():
+    """
+    Precompute every valid /results query, html and json.
+    """
+    with app.test_request_context():
+        for key in result_keys():
+            try:
+                results_cache.get_or_compute(key, lambda: render_results(key))
+                plans_cache.get_or_compute(key, lambda: render_plan_json(key))
+            except PlanError:
+                pass
+
+
+def flower_type(value: Any) -> main.FlowerType:
+    """
+    Flower type from a user given name: "roses", "ROSES", "__ROSES__"...
+    """
+    attr = getattr(main.Flower, str(value).strip("_").upper(), None)
+    if attr not in main.Flower.flowertypes:
+        raise PlanError(f"Unknown flower type {value!r}")
+    return attr
+
+
+def flower_color(value: Any) -> main.FlowerColor:
+    """
+    Flower color from a user given name: "blue", "BLUE", "Blue"...
+    """
+    attr = getattr(main.Flower, str(value).upper(), None)
+    if attr not in main.Flower.flowercolors:
+        raise PlanError(f"Unknown flower color {value!r}")
+    return attr
+
+
+def json_flag(spec: Dict[str, Any], defaults: Dict[str, Any], name: str, default: bool) -> bool:
+    """
+    Boolean `name` of a json target, else of the request, else `default`. Only json booleans are
+    accepted: `bool("false")` is True.
+    """
+    value = spec.get(name, defaults.get(name, default))
+    if not isinstance(value, bool):
+        raise PlanError(f'"{name}" must be true or false, got {value!r}')
+    return value
+
+
+class Target(NamedTuple):
+    flower: main.Flower
+    seed: bool
+    island: bool
+    owned: int
+    flowerpedia: Mapping[main.Flower, main.AncestorInfo]
+
+
+def resolve_target(spec: Dict[str, Any], defaults: Dict[str, Any]) -> Target:
+    """
+    Most probable flower of a json target, {"type": ..., "color" or "code": ...}, and its FlowerPedia.
+    """
+    tgt_type = flower_type(spec.get("type"))
+    seed = json_flag(spec, defaults, "seed", True)
+    island = json_flag(spec, defaults, "island", False)
+    codes = spec.get("owned", defaults.get("owned", []))
+    if not isinstance(codes, list):
+        raise PlanError('"owned" must be a list of gene codes')
+    owned = owned_mask(tgt_type, codes)
+
+    flowerpedia = get_flowerpedia(tgt_type, seed, island, owned)
+
+    if "code" in spec:
+        tgt = [parse_flower(tgt_type, spec["code"])]
+    else:
+        tgt = main.uget(main.flower_info, _type=tgt_type, _color=flower_color(spec.get("color")))
+        if len(tgt) == 0:
+            raise PlanError("This target does not exist")
+
+    best_flower = max(tgt, key=lambda x: flowerpedia[x].total_prob if x in flowerpedia else -math.inf)
+    if best_flower not in flowerpedia:
+        raise PlanError("This target cannot be obtained from these flowers")
+
+    return Target(best_flower, seed, island, owned, flowerpedia)
+
+
+PlanMemos = Dict[Tuple[main.FlowerType, bool, bool, int], Dict[main.Flower, Dict[str, Any]]]
+
+
+def plan_target(spec: Dict[str, Any], defaults: Dict[str, Any], memos: Optional[PlanMemos] = None) -> Dict[str, Any]:
+    """
+    Plan of a single /api/plan target. `memos` shares the plan nodes of common ancestors between
+    the targets of a request, per (type, seed, island, owned) FlowerPedia.
+    """
+    best_flower, seed, island, owned, flowerpedia = resolve_target(spec, defaults)
+    tgt_type = best_flower.type
+    k = plans_count(spec.get("plans", defaults.get("plans", 1)))
+
+    memo = None if memos is None else memos.setdefault((tgt_type, seed, island, owned), {})
+    plan = main.build_plan(best_flower, flowerpedia, memo)
+    return {
+        "type": tgt_type.strip("_").capitalize(),
+        "color": best_flower.color,
+        "seed": seed,
+        "island": island,
+        "owned": owned_codes(tgt_type, owned),
+        "target": best_flower.code,
+        "total_prob": flowerpedia[best_flower].total_prob,
+        "graph": plan.graph,
+        "steps": steps_json(plan.steps, plan.names),
+        "names": plan.names,
+        "alternatives": ranked_plans_json(ranked_plans(best_flower, seed, island, owned, k)) if k > 1 else [],
+    }
+
+
+@app.route("/api/plan", methods=["POST"])
+def api_plan():
+    """
+    Batched breeding plans. Expects a json body:
+
+        {"seed": true, "island": false, "owned": ["RR yy WW ss", ...],
+         "targets": [{"type": "roses", "color": "blue"}, {"type": "roses", "code": "RR YY ww ss"}, ...]}
+
+    `seed`, `island`, `owned` (gene codes of other flowers already owned) and `plans` (number of
+    ranked plans to list in "alternatives", 1 by default) may also be given per target. Answers {"plans": [plan or {"error": ...}, ...]},
+    in the order of the targets.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("targets"), list):
+        return jsonify(error='Expected a json object with a "targets" list'), 400
+    try:
+        # Defaults of every target: a bad one is an error of the whole request.
+        json_flag(body, {}, "seed", True)
+        json_flag(body, {}, "island", False)
+    except PlanError as e:
+        return jsonify(error=str(e)), 400
+
+    memos: PlanMemos = {}
+    plans = []
+    for spec in body["targets"]:
+        try:
+            if not isinstance(spec, dict):
+                raise PlanError("A target must be a json object")
+            plans.append(plan_target(spec, body, memos))
+        except PlanError as e:
+            plans.append({"error": str(e)})
+
+    return jsonify(plans=plans)
+
+
+def get_job_queue() -> JobQueue:
+    """
+    Job queue of /api/jobs, created on first use so that its process pool starts in the worker.
+    """
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue(
+                    app.config.get("JOBS_DB", path.join(main.DB_DIR, "jobs.sqlite3")),
+                    {"plan": run_plan_job},
+                    workers=app.config.get("JOBS_WORKERS", 2),
+                )
+    return _job_queue
+
+
+_job_queue: Optional[JobQueue] = None
+_job_queue_lock = threading.Lock()
+
+
+def plan_job(spec: Dict[str, Any], defaults: Dict[str, Any]) -> Tuple[List[Any], Dict[str, Any]]:
+    """
+    Canonical key and arguments of the /api/jobs job of a target: equivalent targets (gene code
+    spelling, owned flowers order...) give the same job. Validated without exploring anything.
+    """
+    from flower import store
+
+    tgt_type = flower_type(spec.get("type"))
+    codes = spec.get("owned", defaults.get("owned", []))
+    if not isinstance(codes, list):
+        raise PlanError('"owned" must be a list of gene codes')
+    job = {
+        "type": tgt_type,
+        "seed": json_flag(spec, defaults, "seed", True),
+        "island": json_flag(spec, defaults, "island", False),
+        "owned": owned_codes(tgt_type, owned_mask(tgt_type, codes)),
+        "plans": plans_count(spec.get("plans", defaults.get("plans", 1))),
+    }
+    if "code" in spec:
+        job["code"] = parse_flower(tgt_type, spec["code"]).code
+    else:
+        job["color"] = flower_color(spec.get("color"))
+    # Results of other csv files or of another explore are other jobs.
+    key = ["plan", sorted(job.items()), main.data_digest().hex(), store.ALGORITHM_VERSION]
+    return key, job
+
+
+def run_plan_job(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    /api/jobs handler, runs in the job queue process pool.
+    """
+    return plan_target(spec, {})
+
+
+@app.route("/api/jobs", methods=["POST"])
+def api_submit_job():
+    """
+    Plan a target in the background, for the targets which miss the prebuilt DB (owned flowers,
+    several plans...). Expects the json of one /api/plan target, `seed`, `island`, `owned` and `plans`
+    included. Answers 202 {"id": ..., "status": ...}: poll /api/jobs/<id>, then get /api/jobs/<id>/result.
+    Identical targets share one job, finished jobs are kept across restarts.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify(error="Expected a json object"), 400
+    try:
+        key, job = plan_job(body, {})
+    except PlanError as e:
+        return jsonify(error=str(e)), 400
+
+    queue = get_job_queue()
+    job_id = queue.submit(key, "plan", {"spec": job})
+    response = jsonify(queue.status(job_id))
+    response.status_code = 202
+    response.headers["Location"] = f"/api/jobs/{job_id}"
+    return response
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def api_job_status(job_id: str):
+    status = get_job_queue().status(job_id)
+    if status is None:
+        return jsonify(error="Unknown job"), 404
+    return jsonify(status)
+
+
+@app.route("/api/jobs/<job_id>/result", methods=["GET"])
+def api_job_result(job_id: str):
+    """
+    Result of a done job, its status with 202 while pending, its error with 400 when failed.
+    """
+    queue = get_job_queue()
+    status = queue.status(job_id)
+    if status is None:
+        return jsonify(error="Unknown job"), 404
+    if status["status"] == "pending":
+        return jsonify(status), 202
+    if status["status"] == "failed":
+        return jsonify(error=status["error"]), 400
+    return jsonify(queue.result(job_id))
+
+
+SIMULATION_MAX_TRIALS = app.config.get("SIMULATION_MAX_TRIALS", 10 ** 6)
+
+
+@app.route("/api/simulate", methods=["POST"])
+def api_simulate():
+    """
+    Monte Carlo simulation of the plan of one target. Expects a json body:
+
+        {"type": "roses", "color": "blue", "seed": true, "island": false, "owned": [...],
+         "trials": 100000, "random_seed": 0, "percentiles": [50, 90, 99]}
+
+    Answers the attempts needed by each step and by the whole plan, see `flower.simulate.summary`.
+    Runs in the request, `trials` is bounded by SIMULATION_MAX_TRIALS.
+    """
+    from flower import simulate
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify(error="Expected a json object"), 400
+
+    try:
+        target = resolve_target(body, {})
+        trials = body.get("trials", 100_000)
+        if not isinstance(trials, int) or not 0 < trials <= SIMULATION_MAX_TRIALS:
+            raise PlanError(f"The number of trials must be between 1 and {SIMULATION_MAX_TRIALS}")
+        random_seed = body.get("random_seed")
+        if random_seed is not None and (not isinstance(random_seed, int) or random_seed < 0):
+            raise PlanError("random_seed must be a non negative integer")
+        percentiles = body.get("percentiles", list(simulate.PERCENTILES))
+        if not isinstance(percentiles, list) or not all(
+            isinstance(q, (int, float)) and 0 < q <= 100 for q in percentiles
+        ):
+            raise PlanError("percentiles must be a list of numbers in ]0, 100]")
+    except PlanError as e:
+        return jsonify(error=str(e)), 400
+
+    model = simulate.plan_model(main.build_plan(target.flower, target.flowerpedia), target.flowerpedia)
+    hist = simulate.simulate(model, trials, random_seed)
+    return jsonify(
+        total_prob=target.flowerpedia[target.flower].total_prob,
+        random_seed=random_seed,
+        **simulate.summary(model, hist, percentiles),
+    )
+
+
+CROSS_MAX_PAIRS = app.config.get("CROSS_MAX_PAIRS", 10_000)
+
+
+@app.route("/api/cross", methods=["POST"])
+def api_cross():
+    """
+    Offspring of many parent pairs of one flower type. Expects a json body:
+
+        {"type": "roses", "pairs": [["RR yy WW ss", "rr YY WW ss"], [[2, 0, 0, 0], "0200"], ...],
+         "offspring": true}
+
+    Answers the color probabilities of each pair, in order, and unless "offspring" is false every
+    child with its color and probability, see `flower.genetics.Genetics.cross_summary`.
+    At most CROSS_MAX_PAIRS pairs per request.
+    """
+    from flower import genetics
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify(error="Expected a json object"), 400
+
+    try:
+        tgt_type = flower_type(body.get("type"))
+        pairs = body.get("pairs")
+        if not isinstance(pairs, list) or not 0 < len(pairs) <= CROSS_MAX_PAIRS:
+            raise PlanError(f'"pairs" must be a list of 1 to {CROSS_MAX_PAIRS} pairs of gene codes')
+
+        g = genetics.genetics(tgt_type)
+        parents_a, parents_b = [], []
+        for n, pair in enumerate(pairs):
+            if not isinstance(pair, list) or len(pair) != 2:
+                raise PlanError(f"pairs[{n}]: expected 2 gene codes")
+            try:
+                parents_a.append(g.parse(pair[0]))
+                parents_b.append(g.parse(pair[1]))
+            except ValueError as e:
+                raise PlanError(f"pairs[{n}]: {e}")
+        offspring = json_flag(body, {}, "offspring", True)
+    except PlanError as e:
+        return jsonify(error=str(e)), 400
+
+    return jsonify(
+        type=tgt_type.strip("_").capitalize(),
+        pairs=g.cross_summary(parents_a, parents_b, offspring=offspring),
+    )
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # Explore counters stay empty unless FLOWER_INSTRUMENT is set.
+    body = prometheus_metrics([results_cache, plans_cache, inventory_cache, ranked_cache]) + main.explore_metrics.prometheus()
+    if _job_queue is not None:
+        body += "# TYPE flower_jobs gauge\n" + "".join(
+            f'flower_jobs{{status="{status}"}} {n}\n' for status, n in _job_queue.stats().items()
+        )
+    response = make_response(body)
+    response.mimetype = "text/plain"
+    return response
+
+
 @app.route("/compatibility", methods=["POST"])
 def request_compatible_colors():
     form = request.form
@@ -94,11 +725,13 @@ def request_compatible_colors():
     tgt = "type" if change == "color" else "color"
     flower_attr = getattr(main.Flower, form[f"flower_{change}"], None)
     if flower_attr:
-        possible = sorted({
-            getattr(f, tgt).strip("_").capitalize() for f in main.uget(main.flower_info, **{f"_{change}": flower_attr})
-        })
-        
+        # Memoized by the index, never scans flowers.
+        possible = sorted(
+            v.strip("_").capitalize()
+            for v in main.get_flower_index().distinct(tgt, **{f"_{change}": flower_attr})
+        )
+
         return json.dumps({f"{tgt}s": possible})
-    
+
     else:
-        return json.dumps({f"{tgt}s": []})
\ No newline at end of file
+        return json.dumps({f"{tgt}s": []})
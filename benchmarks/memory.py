@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+"""
+Memory per worker of each FlowerPedia DB layout, the way gunicorn runs the app:
+
+    python benchmarks/memory.py [--workers 4] [--no-preload]
+
+For each layout (`objects`: partition files decoded into each process, `mapped`: the shared
+memory-mapped file), a fresh master loads the app (and preloads it, like `gunicorn.conf.py`),
+then forks workers which plan every flower of every partition. Each worker reports its RSS,
+PSS (shared pages divided among the processes sharing them) and private memory, from
+/proc/self/smaps_rollup (Linux only).
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from os import path
+
+ROOT_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+
+WORKER = """
+import json, os, sys
+sys.path.insert(0, {root!r})
+from app import routes
+from flower import main
+
+if {preload!r}:
+    routes.preload()
+
+
+def memory():
+    res = {{}}
+    with open("/proc/self/smaps_rollup") as fp:
+        for line in fp:
+            name, *value = line.split()
+            if name in ("Rss:", "Pss:", "Private_Clean:", "Private_Dirty:"):
+                res[name[:-1]] = int(value[0])
+    return {{"rss": res["Rss"], "pss": res["Pss"], "private": res["Private_Clean"] + res["Private_Dirty"]}}
+
+
+def work():
+    db = routes.get_flower_db()
+    for key in db:
+        flowerpedia = db[key]
+        for f in flowerpedia:
+            main.build_plan(f, flowerpedia)
+
+
+# Workers stay alive until every one of them is measured, so that they share pages as they would.
+release_r, release_w = os.pipe()
+pipes = []
+for _ in range({workers}):
+    r, w = os.pipe()
+    if os.fork() == 0:
+        os.close(r)
+        os.close(release_w)
+        work()
+        os.write(w, json.dumps(memory()).encode())
+        os.read(release_r, 1)
+        os._exit(0)
+    os.close(w)
+    pipes.append(r)
+
+reports = [json.loads(os.read(r, 4096)) for r in pipes]
+os.close(release_w)
+for _ in pipes:
+    os.wait()
+print(json.dumps({{"db": type(routes.get_flower_db()).__name__, "master": memory(), "workers": reports}}))
+"""
+
+
+def run(layout: str, workers: int, preload: bool) -> dict:
+    env = dict(os.environ, FLOWER_DB_MAPPED="1" if layout == "mapped" else "0")
+    code = WORKER.format(root=ROOT_DIR, preload=preload, workers=workers)
+    out = subprocess.run([sys.executable, "-c", code], env=env, check=True, capture_output=True, text=True, cwd="/")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-w", "--workers", type=int, default=4)
+    parser.add_argument("--no-preload", action="store_true", help="Workers load the DB themselves")
+    parser.add_argument("--json", action="store_true", help="Machine readable output")
+    args = parser.parse_args()
+
+    results = {layout: run(layout, args.workers, not args.no_preload) for layout in ("objects", "mapped")}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'layout':<8} {'db':<20} {'worker rss':>11} {'worker pss':>11} {'private':>9}  (KiB, mean of {args.workers})")
+    for layout, r in results.items():
+        mean = {m: sum(w[m] for w in r["workers"]) / len(r["workers"]) for m in ("rss", "pss", "private")}
+        print(f"{layout:<8} {r['db']:<20} {mean['rss']:>11.0f} {mean['pss']:>11.0f} {mean['private']:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
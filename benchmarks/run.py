@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark suite of the genetics engine and of the web request path.
+
+    python benchmarks/run.py [--group micro|macro|e2e] [--output results.json]
+    python benchmarks/run.py --compare baseline.json [--threshold 0.2]
+
+Groups:
+    micro   building blocks: mix_flowers, Flower.__add__, prob_test_hybrid (both engines), genetics color_probs, ancestors, plan_graph, stepify, build_plan, read_code
+    macro   explore() of every (type, seed, island) DB partition, for each engine, and search
+            queries of the most probable flower of each color
+    e2e     /results and /compatibility through the Flask test client
+
+Every benchmark reports the median and min time of a single call, in seconds.
+With --compare, benchmarks whose min time is slower than the baseline by more than the
+threshold are reported as regressions and the exit code is 1 (min is the least noisy).
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+from functools import partial
+from os import path
+from typing import *
+
+ROOT_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from flower import main  # noqa: E402
+
+Result = Dict[str, float]
+ENGINES = ["reference", "genotype", "bounded", "search"]
+
+
+def measure(fn: Callable[[], Any], repeat: int, number: Optional[int] = None) -> Result:
+    """
+    Time `fn`: `repeat` rounds of `number` calls (auto-ranged to ~0.2s when not given).
+    """
+    timer = timeit.Timer(fn)
+    if number is None:
+        number, _ = timer.autorange()
+    rounds = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {"median": statistics.median(rounds), "min": min(rounds), "number": number}
+
+
+def micro_benchmarks(repeat: int) -> Dict[str, Result]:
+    Flower = main.Flower
+    roses_seed = main.get_flowerpedia_db()[(Flower.ROSES, True, False)]
+    blue_rose = main.Flower(Flower.ROSES, main.read_code("RR YY ww ss"))
+    plan = main.plan_graph(blue_rose, roses_seed)
+
+    # A rose obtained with a color test: the expensive path of prob_test_hybrid.
+    tested = next(f for f in roses_seed if roses_seed[f].test.test_flower is not None)
+    t_info = roses_seed[tested]
+    t_parents = t_info.parents
+    t_known = t_info.ancestors | set(t_parents)
+
+    f1, f2 = Flower(Flower.ROSES, (1, 1, 1, 1)), Flower(Flower.ROSES, (1, 2, 1, 0))
+
+    from flower import genetics, genotype
+
+    sp = genotype.species(Flower.ROSES)
+    g_parents = [sp.index(f) for f in t_parents]
+    g_known = sum(1 << sp.index(f) for f in t_known)
+
+    roses = genetics.genetics(Flower.ROSES)
+    pairs_a, pairs_b = zip(*[(i, j) for i in sp.known for j in sp.known])
+
+    return {
+        "micro/mix_flowers uncached": measure(lambda: main.mix_flowers.__wrapped__(f1.genes, f2.genes), repeat),
+        "micro/mix_flowers cached": measure(lambda: main.mix_flowers(f1.genes, f2.genes), repeat),
+        "micro/Flower.__add__": measure(lambda: f1 + f2, repeat),
+        "micro/prob_test_hybrid": measure(lambda: main.prob_test_hybrid(*t_parents, tested, t_known), repeat),
+        "micro/genotype prob_test_hybrid": measure(
+            lambda: genotype.prob_test_hybrid(sp, *g_parents, sp.index(tested), g_known), repeat
+        ),
+        "micro/genetics color_probs all roses pairs": measure(lambda: roses.color_probs(pairs_a, pairs_b), repeat),
+        "micro/ancestors": measure(lambda: main.ancestors(blue_rose, roses_seed), repeat),
+        "micro/plan_graph": measure(lambda: main.plan_graph(blue_rose, roses_seed), repeat),
+        "micro/stepify": measure(lambda: main.stepify(blue_rose, plan), repeat),
+        "micro/build_plan": measure(lambda: main.build_plan(blue_rose, roses_seed), repeat),
+        "micro/read_code": measure(lambda: main.read_code("Rr Yy ww Ss"), repeat),
+    }
+
+
+def macro_benchmarks(repeat: int, engines: List[str]) -> Dict[str, Result]:
+    from flower import genotype
+    from flower.engines import queries
+
+    def indexed(explore_indices):
+        def run(base_flowers):
+            sp = genotype.species(base_flowers[0].type)
+            return explore_indices(sp, [sp.index(f) for f in base_flowers])
+
+        return run
+
+    available = {
+        "reference": main.explore,
+        "genotype": indexed(genotype.explore_indices),
+        "bounded": indexed(genotype.explore_bounded),
+    }
+
+    res = {}
+    for key, base_flowers in main.db_partitions():
+        if not base_flowers:
+            continue
+        flower_type, seed, island = key
+        name = f"{flower_type.strip('_').lower()} seed={int(seed)} island={int(island)}"
+        for engine in engines:
+            if engine == "search":
+                for color, targets in queries(flower_type):
+                    query = partial(genotype.search, base_flowers, targets, True)
+                    query()
+                    res[f"macro/search/{name} {color.lower()}"] = measure(query, repeat, number=1)
+                continue
+            explore = available[engine]
+            explore(base_flowers)  # Warm up species tables and caches.
+            res[f"macro/{engine}/{name}"] = measure(lambda: explore(base_flowers), repeat, number=1)
+    return res
+
+
+def e2e_benchmarks(repeat: int) -> Dict[str, Result]:
+    from app import app, routes
+
+    client = app.test_client()
+    routes.preload()
+
+    def results(tgt_type, tgt_color, cached):
+        def run():
+            if not cached:
+                routes.results_cache.clear()
+            r = client.post("/results", data={"tgt_type": tgt_type, "tgt_color": tgt_color, "seed": "on"})
+            assert r.status_code == 200
+
+        return run
+
+    def compatibility():
+        r = client.post("/compatibility", data={"change_from": "type", "flower_type": "ROSES"})
+        assert r.status_code == 200
+
+    return {
+        "e2e/results roses blue": measure(results("ROSES", "BLUE", cached=False), repeat),
+        "e2e/results roses blue cached": measure(results("ROSES", "BLUE", cached=True), repeat),
+        "e2e/results cosmos black": measure(results("COSMOS", "BLACK", cached=False), repeat),
+        "e2e/compatibility": measure(compatibility, repeat),
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict[str, Result], baseline: Dict[str, Result], threshold: float) -> int:
+    """
+    Print current / baseline min time ratios, returns the number of regressions.
+    """
+    regressions = 0
+    for name in sorted(results):
+        if name not in baseline:
+            print(f"{'new':>10}  {name}")
+            continue
+        ratio = results[name]["min"] / baseline[name]["min"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{ratio:>9.2f}x  {name}{flag}")
+    return regressions
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-g", "--group", choices=["micro", "macro", "e2e"], action="append", help="Default: all")
+    parser.add_argument("-n", "--repeat", type=int, default=5)
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        action="append",
+        help="Engines of the macro benchmarks (default: all)",
+    )
+    parser.add_argument("-o", "--output", help="Write results to this json file")
+    parser.add_argument("--compare", help="Baseline json file written by --output")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Tolerated slowdown ratio (default: 0.2)")
+    args = parser.parse_args()
+
+    groups = args.group or ["micro", "macro", "e2e"]
+    results: Dict[str, Result] = {}
+    if "micro" in groups:
+        results.update(micro_benchmarks(args.repeat))
+    if "macro" in groups:
+        results.update(macro_benchmarks(args.repeat, args.engine or ENGINES))
+    if "e2e" in groups:
+        results.update(e2e_benchmarks(args.repeat))
+
+    for name, r in results.items():
+        print(f"{r['median'] * 1e6:>14.2f} us  (min {r['min'] * 1e6:.2f} us)  {name}")
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(
+                {
+                    "meta": {
+                        "python": platform.python_version(),
+                        "platform": platform.platform(),
+                        "revision": git_revision(),
+                        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    },
+                    "results": results,
+                },
+                fp,
+                indent=2,
+            )
+
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)["results"]
+        print()
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+"""
+Cold start benchmark, every measure runs in a fresh interpreter:
+
+    python benchmarks/startup.py [--repeat N]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from os import path
+
+ROOT_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+
+# Each snippet prints the number of seconds it took.
+SCENARIOS = {
+    "import flower.main": """
+t0 = time.perf_counter()
+from flower import main
+print(time.perf_counter() - t0)
+""",
+    "first flower_info access": """
+from flower import main
+t0 = time.perf_counter()
+main.get_flower_info()
+print(time.perf_counter() - t0)
+""",
+    "import app": """
+t0 = time.perf_counter()
+import app
+print(time.perf_counter() - t0)
+""",
+    "import app + first /results": """
+t0 = time.perf_counter()
+from app import app
+app.test_client().post("/results", data={"tgt_type": "ROSES", "tgt_color": "BLUE", "seed": "on"})
+print(time.perf_counter() - t0)
+""",
+    "preload": """
+t0 = time.perf_counter()
+from app import routes
+routes.preload()
+print(time.perf_counter() - t0)
+""",
+}
+
+
+def run(snippet: str) -> float:
+    code = f"import sys, time\nsys.path.insert(0, {ROOT_DIR!r})\n{snippet}"
+    out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True, cwd="/")
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="Machine readable output")
+    args = parser.parse_args()
+
+    results = {}
+    for name, snippet in SCENARIOS.items():
+        timings = [run(snippet) for _ in range(args.repeat)]
+        results[name] = {"median": statistics.median(timings), "min": min(timings)}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, r in results.items():
+            print(f"{name:<30} median {r['median'] * 1000:8.2f} ms   min {r['min'] * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+"""
+Breeding optimisation for Animal Crossing: New Horizons flowers.
+"""
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+"""
+Maintenance commands, run from the repository root:
+
+    python -m flower check-engines
+    python -m flower build-bundle [--check]
+    python -m flower build-db [--workers N] [--stale-only]
+    python -m flower profile -t roses [-s] [-i] [--engine genotype] [-o roses.prof] [--target "RR YY ww ss"]
+    python -m flower simulate -t roses -c blue [-s] [-i] [-n 1000000] [--random-seed 0] [-w 4]
+    python -m flower cross -t roses "RR yy WW ss + rr YY WW ss" [-f pairs.txt] [--colors-only] [--json]
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from flower import main
+
+
+def check_engines(args) -> int:
+    """
+    Compare every exploration engine against `flower.main.explore` on all DB partitions, then the
+    `genotype.search` queries of every color (`tests/test_engines.py` runs the same comparisons under pytest).
+    """
+    from flower import genotype
+    from flower.engines import differences, engines, queries, query_differences
+
+    failures = 0
+    for key, base_flowers in main.db_partitions():
+        if args.type and key[0] not in args.type:
+            continue
+
+        t0 = time.perf_counter()
+        reference = main.explore(base_flowers)
+        timings = [f"reference {time.perf_counter() - t0:.3f}s"]
+
+        for name, engine in engines().items():
+            t0 = time.perf_counter()
+            flowerpedia = engine(base_flowers)
+            timings.append(f"{name} {time.perf_counter() - t0:.3f}s")
+
+            if differences(reference, flowerpedia):
+                failures += 1
+                print(f"MISMATCH {name} {key}")
+
+        t0 = time.perf_counter()
+        for color, targets in queries(key[0]):
+            for stop_at_first in (False, True):
+                flowerpedia = genotype.search(base_flowers, targets, stop_at_first)
+                if query_differences(reference, flowerpedia, targets, stop_at_first):
+                    failures += 1
+                    print(f"MISMATCH search {key} {color} stop_at_first={stop_at_first}")
+        timings.append(f"target queries {time.perf_counter() - t0:.3f}s")
+
+        print(key, ", ".join(timings))
+
+    print("OK" if failures == 0 else f"{failures} mismatch(es)")
+    return 1 if failures else 0
+
+
+def build_bundle(args) -> int:
+    """
+    Validate the data csv files and compile them into the genetics bundle.
+    """
+    try:
+        if args.check:
+            _, notes = main.validate_flower_data(main.flower_files)
+        else:
+            notes = main.write_flower_bundle(args.output)
+    except ValueError as e:
+        print(e)
+        return 1
+
+    for note in notes:
+        print(note)
+    print("Flower data is valid" if args.check else f"{args.output} written")
+    return 0
+
+
+def build_db(args) -> int:
+    """
+    Rebuild FlowerPedia DB partitions in parallel.
+    """
+    from flower import store
+
+    keys = None
+    if args.type:
+        keys = [key for key, _ in main.db_partitions() if key[0] in args.type]
+
+    t0 = time.perf_counter()
+    timings = store.build_db(args.db, workers=args.workers, keys=keys, stale_only=args.stale_only)
+    print(
+        f"{len(timings)} partition(s) built in {time.perf_counter() - t0:.3f}s "
+        f"({sum(timings.values()):.3f}s of cpu)"
+    )
+    print(f"{store.write_map(args.db)} written")
+    return 0
+
+
+def profile(args) -> int:
+    """
+    Explore one partition with per sweep counters, optionally under cProfile.
+    """
+    from flower import genotype
+
+    targets = [main.Flower(args.type, main.read_code(code)) for code in args.target or []]
+    engines = {
+        "reference": main.explore,
+        "genotype": genotype.explore,
+        "bounded": lambda base_flowers, stats: genotype.search(base_flowers, targets or None, stats=stats),
+    }
+    base_flowers = main.partition_base_flowers((args.type, args.seed, args.island))
+    if not base_flowers:
+        print("No base flower in this partition")
+        return 1
+    if args.target and args.engine != "bounded":
+        print("--target is only supported by the bounded engine")
+        return 1
+
+    stats = main.ExploreStats(args.engine)
+    if args.output:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.runcall(engines[args.engine], base_flowers, stats)
+        # Readable by pstats, snakeviz, or flameprof / gprof2dot for a flamegraph.
+        profiler.dump_stats(args.output)
+        print(f"cProfile stats written to {args.output}")
+    else:
+        engines[args.engine](base_flowers, stats)
+
+    print(stats.report())
+    return 0
+
+
+def simulate(args) -> int:
+    """
+    Monte Carlo simulation of the best plan of a target, from the DB partition.
+    """
+    from flower import simulate
+
+    if not (args.seed or args.island):
+        print("At least one of --seed or --island is needed")
+        return 1
+    flowerpedia = main.get_flowerpedia_db()[(args.type, args.seed, args.island)]
+    if args.code:
+        targets = [main.Flower(args.type, main.read_code(args.code))]
+    else:
+        targets = main.uget(main.get_flower_info(), _type=args.type, _color=args.color)
+    targets = [f for f in targets if f in flowerpedia]
+    if not targets:
+        print("This target cannot be obtained from these flowers")
+        return 1
+    target = max(targets, key=lambda f: flowerpedia[f].total_prob)
+
+    model = simulate.plan_model(main.build_plan(target, flowerpedia), flowerpedia)
+    t0 = time.perf_counter()
+    hist = simulate.simulate(model, args.trials, args.random_seed, workers=args.workers)
+    t_sim = time.perf_counter() - t0
+
+    print(simulate.report(simulate.summary(model, hist, args.percentile or simulate.PERCENTILES)))
+    print(f"total_prob {flowerpedia[target].total_prob:.4g}, simulated in {t_sim:.3f}s")
+    return 0
+
+
+def cross(args) -> int:
+    """
+    Offspring and color probabilities of parent pairs, "A + B" from the command line or one per line of a file.
+    """
+    from flower import genetics
+
+    lines = list(args.pair)
+    if args.file:
+        with open(args.file) as fp:
+            lines += [line.strip() for line in fp if line.strip()]
+    if not lines:
+        print("No pair given")
+        return 1
+
+    g = genetics.genetics(args.type)
+    parents_a, parents_b = [], []
+    for line in lines:
+        try:
+            code_a, code_b = line.split("+")
+            parents_a.append(g.parse(code_a.strip()))
+            parents_b.append(g.parse(code_b.strip()))
+        except ValueError as e:
+            print(f"{line!r}: {e if '+' in line else 'expected A + B'}")
+            return 1
+
+    g.tables  # Built once per species, not timed.
+    t0 = time.perf_counter()
+    summary = g.cross_summary(parents_a, parents_b, offspring=not args.colors_only)
+    t_cross = time.perf_counter() - t0
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return 0
+    for entry in summary:
+        print(" + ".join(entry["parents"]))
+        print("  " + ", ".join(f"{color} {p:.4g}" for color, p in entry["colors"].items()))
+        for child in entry.get("offspring", []):
+            print(f"    {child['code']}  {child['color']:<7} {child['prob']:.4g}")
+    print(f"{len(summary)} pair(s) in {t_cross * 1e3:.2f} ms")
+    return 0
+
+
+def flower_type(x: str):
+    return getattr(main.Flower, x.upper())
+
+
+def flower_color(x: str):
+    return getattr(main.Flower, x.upper())
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m flower")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    check = commands.add_parser("check-engines", help="Check all engines give the same FlowerPedia")
+    check.add_argument(
+        "-t",
+        "--type",
+        type=flower_type,
+        action="append",
+        help="Only check this flower type (repeatable)",
+    )
+    check.set_defaults(func=check_engines)
+
+    bundle = commands.add_parser("build-bundle", help="Validate data/*.csv and compile them into the genetics bundle")
+    bundle.add_argument("--check", action="store_true", help="Only validate the csv files")
+    bundle.add_argument("-o", "--output", default=main.BUNDLE_FILE, help="Bundle file")
+    bundle.set_defaults(func=build_bundle)
+
+    build = commands.add_parser("build-db", help="Rebuild the FlowerPedia DB over a process pool, then its mapped layout")
+    build.add_argument("-w", "--workers", type=int, default=None, help="Number of processes (default: cpu count)")
+    build.add_argument("-t", "--type", type=flower_type, action="append", help="Only build this flower type (repeatable)")
+    build.add_argument("--stale-only", action="store_true", help="Skip partitions that are up to date")
+    build.add_argument("--db", default=main.DB_DIR, help="DB directory")
+    build.set_defaults(func=build_db)
+
+    prof = commands.add_parser("profile", help="Per sweep explore counters of one partition")
+    prof.add_argument("-t", "--type", type=flower_type, required=True)
+    prof.add_argument("-s", "--seed", action="store_true", help="Seed flowers partition")
+    prof.add_argument("-i", "--island", action="store_true", help="Island flowers partition")
+    prof.add_argument("--engine", choices=["reference", "genotype", "bounded"], default="reference")
+    prof.add_argument("-o", "--output", help="Also dump cProfile stats to this file")
+    prof.add_argument(
+        "--target",
+        action="append",
+        help='Bounded engine: stop once this flower ("RR YY ww ss") is settled (repeatable)',
+    )
+    prof.set_defaults(func=profile)
+
+    sim = commands.add_parser("simulate", help="Monte Carlo simulation of the attempts of a breeding plan")
+    sim.add_argument("-t", "--type", type=flower_type, required=True)
+    target = sim.add_mutually_exclusive_group(required=True)
+    target.add_argument("-c", "--color", type=flower_color, help="Most probable flower of this color")
+    target.add_argument("--code", help='Gene code of the target, e.g. "RR YY ww ss"')
+    sim.add_argument("-s", "--seed", action="store_true", help="Seed flowers partition")
+    sim.add_argument("-i", "--island", action="store_true", help="Island flowers partition")
+    sim.add_argument("-n", "--trials", type=int, default=10 ** 6)
+    sim.add_argument("--random-seed", type=int, default=None, help="Seed of the random generator")
+    sim.add_argument("-w", "--workers", type=int, default=1, help="Number of processes (default: 1)")
+    sim.add_argument("-p", "--percentile", type=float, action="append", help="Default: 50, 90 and 99 (repeatable)")
+    sim.set_defaults(func=simulate)
+
+    crs = commands.add_parser("cross", help="Offspring and color probabilities of parent pairs")
+    crs.add_argument("-t", "--type", type=flower_type, required=True)
+    crs.add_argument("pair", nargs="*", help='Parents "A + B", gene codes like "RR yy WW ss" or "2020"')
+    crs.add_argument("-f", "--file", help="Also read pairs from this file, one per line")
+    crs.add_argument("--colors-only", action="store_true", help="Only color probabilities")
+    crs.add_argument("--json", action="store_true", help="Machine readable output")
+    crs.set_defaults(func=cross)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    sys.exit(args.func(args))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+"""
+File:   engines.py
+
+Exploration engines which must give the FlowerPedia of the reference `flower.main.explore`:
+same flowers, in the same discovery order, with the same `AncestorInfo`. Targeted queries of
+`flower.genotype.search` stop early on a heuristic bound: they are checked to give the entries of the
+reference for the targets found and their plans.
+Checked by `tests/test_engines.py` and `python -m flower check-engines`.
+"""
+
+from typing import *
+
+from flower.main import Flower, FlowerPedia, get_flower_info, uget
+
+
+def engines() -> Dict[str, Callable[[List[Flower]], FlowerPedia]]:
+    """
+    Engines by name, each one called with the base flowers of a partition.
+    """
+    from flower import genotype
+
+    return {
+        "genotype": genotype.explore,
+        "bounded": genotype.search,
+    }
+
+
+def queries(flower_type) -> Iterator[Tuple[str, List[Flower]]]:
+    """
+    Targets of the `search` queries of a flower type: every flower of each of its colors.
+    """
+    for color in Flower.flowercolors:
+        targets = uget(get_flower_info(), _type=flower_type, _color=color)
+        if targets:
+            yield color, targets
+
+
+def differences(reference: FlowerPedia, flowerpedia: FlowerPedia) -> List[Flower]:
+    """
+    Flowers whose entry differs from `reference`, or every flower when the discovery order differs.
+    """
+    if list(flowerpedia) != list(reference):
+        return sorted(set(reference) | set(flowerpedia))
+    return [f for f, info in reference.items() if flowerpedia[f] != info]
+
+
+def query_differences(
+    reference: FlowerPedia, flowerpedia: FlowerPedia, targets: List[Flower], stop_at_first: bool
+) -> List[Flower]:
+    """
+    Flowers of the answer to a `search` query whose entry differs from `reference`, or that are
+    missing or unexpected. The answer holds the targets found (only the most probable one with
+    `stop_at_first`) and the flowers of their plans.
+    """
+    found = [f for f in targets if f in reference]
+    if stop_at_first and found:
+        found = [max(found, key=lambda f: reference[f].total_prob)]
+    expected = set(found).union(*(reference[f].ancestors for f in found))
+    if set(flowerpedia) != expected:
+        return sorted(expected ^ set(flowerpedia))
+    return sorted(f for f in expected if flowerpedia[f] != reference[f])
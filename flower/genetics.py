@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+"""
+File:   genetics.py
+
+Factorized offspring distributions with NumPy.
+
+Genes are inherited independently: the offspring distribution of a pair is the product of one
+3-outcome distribution per gene (`flower.main.mix_d`). Here it is kept in factorized form, an
+(n_genes x 3) array, instead of 3 ** n_genes (genotype, probability) couples:
+
+    - `offspring` expands the factors gene by gene with outer products, in genotype order. Every
+      probability is the product of its gene probabilities from the first gene to the last, as
+      `flower.main.mix_flowers` computes it: both give the same floats.
+    - `color_probs` contracts the factors, gene after gene, with the color lookup tensor of the
+      species (one axis per gene, then one per color): offspring are never enumerated. Sums are
+      not done in the order of `Species.color_probs`, but probabilities are multiples of
+      1 / 4 ** n_genes: sums are exact, both give the same floats.
+
+Every function takes a batch of parent pairs, as two arrays of genotype indices. `cross` answers
+them from complete per-pair tables for species of at most `TABLE_SIZE` genotypes.
+"""
+
+import itertools as it
+
+from functools import lru_cache
+from typing import *
+
+import numpy as np
+
+from flower.main import (
+    Flower,
+    FlowerType,
+    gene_layout,
+    gene_names,
+    genotype_index,
+    get_flower_info,
+    mix_d,
+    read_code,
+)
+
+# MIX[g1, g2, g]: probability that parent genes g1 and g2 give the gene g.
+MIX = np.zeros((3, 3, 3))
+for (g1, g2), dist in mix_d.items():
+    for g, p in dist:
+        MIX[g1, g2, g] = p
+
+NO_COLOR = -1
+# Species up to this size get complete pair tables (4 genes: 81 x 81 pairs, 4.7 MB), see `Genetics.tables`.
+TABLE_SIZE = 3 ** 4
+
+
+class Genetics:
+    """
+    Lookup tensors of a single flower type, sized by its `gene_layout`.
+    """
+
+    def __init__(self, flower_type: FlowerType):
+        self.type = flower_type
+        self.layout = gene_layout(flower_type)
+        self.n_genes = len(self.layout)
+        self.size = 3 ** self.n_genes
+
+        # genes[g]: genes of the genotype g, most significant first.
+        self.genes = np.array(list(it.product(range(3), repeat=self.n_genes)), dtype=np.intp)
+
+        self.color = np.full(self.size, NO_COLOR, dtype=np.intp)
+        for f, info in get_flower_info().items():
+            if f.type == flower_type:
+                self.color[genotype_index(f.genes)] = Flower.flowercolors.index(info.color)
+
+        # color_tensor[g_1, ..., g_n, c] is 1 when the genotype (g_1, ..., g_n) has the color c.
+        known = np.flatnonzero(self.color != NO_COLOR)
+        one_hot = np.zeros((self.size, len(Flower.flowercolors)))
+        one_hot[known, self.color[known]] = 1.0
+        self.color_tensor = one_hot.reshape((3,) * self.n_genes + (len(Flower.flowercolors),))
+
+        self.codes = [" ".join(gene_names(letter)[g] for letter, g in zip(self.layout, genes)) for genes in self.genes]
+        self.color_names = [None if c == NO_COLOR else Flower.flowercolors[c] for c in self.color]
+        self._tables: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    def parse(self, code: Union[str, Sequence[int]]) -> int:
+        """
+        Genotype of a known flower from its gene code: "RR yy WW ss" (see `read_code`), "2020",
+        "2,0,2,0" or [2, 0, 2, 0]. Raises ValueError.
+        """
+        if isinstance(code, str):
+            letters = code.replace(" ", "")
+            digits = letters.replace(",", "")
+            if digits.isdigit():
+                genes = tuple(int(g) for g in digits)
+            elif len(letters) == 2 * self.n_genes and all(
+                letters[2 * i : 2 * i + 2].lower() == letter * 2 for i, letter in enumerate(self.layout)
+            ):
+                genes = read_code(letters)
+            else:
+                raise ValueError(f"Invalid gene code {code!r}")
+        elif isinstance(code, Sequence):
+            genes = tuple(code)
+        else:
+            raise ValueError(f"Invalid gene code {code!r}")
+
+        if len(genes) != self.n_genes or any(type(g) is not int or not 0 <= g <= 2 for g in genes):
+            raise ValueError(f"Invalid gene code {code!r}")
+        g = genotype_index(genes)
+        if self.color[g] == NO_COLOR:
+            raise ValueError(f"Unknown flower {code!r}")
+        return g
+
+    def factors(self, a: Sequence[int], b: Sequence[int]) -> np.ndarray:
+        """
+        (batch, n_genes, 3) array: distribution of every gene of the children of `a[k] + b[k]`.
+        """
+        return MIX[self.genes[np.asarray(a)], self.genes[np.asarray(b)]]
+
+    def offspring(self, a: Sequence[int], b: Sequence[int]) -> np.ndarray:
+        """
+        (batch, size) array: probability of every child genotype of `a[k] + b[k]`.
+        """
+        factors = self.factors(a, b)
+        res = np.ones((len(factors), 1))
+        for gene in range(self.n_genes):
+            res = (res[:, :, None] * factors[:, gene, None, :]).reshape(len(factors), -1)
+        return res
+
+    def color_probs(self, a: Sequence[int], b: Sequence[int]) -> np.ndarray:
+        """
+        (batch, number of colors) array: probability of every color of `Flower.flowercolors`
+        among the children of `a[k] + b[k]`.
+        """
+        factors = self.factors(a, b)
+        res = np.tensordot(factors[:, 0], self.color_tensor, axes=1)
+        for gene in range(1, self.n_genes):
+            res = np.einsum("bi...,bi->b...", res, factors[:, gene])
+        return res
+
+    @property
+    def tables(self) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Offspring (size ** 2 x size) and color probabilities (size ** 2 x number of colors) of every
+        pair, at `i * size + j`. Computed on first use, None for species above `TABLE_SIZE`.
+        """
+        if self._tables is None and self.size <= TABLE_SIZE:
+            a, b = np.divmod(np.arange(self.size ** 2), self.size)
+            self._tables = self.offspring(a, b), self.color_probs(a, b)
+        return self._tables
+
+    def cross(self, a: Sequence[int], b: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        `offspring` and `color_probs` of the pairs `a[k] + b[k]`, looked up in `tables` when available.
+        """
+        a, b = np.asarray(a, dtype=np.intp), np.asarray(b, dtype=np.intp)
+        tables = self.tables
+        if tables is None:
+            return self.offspring(a, b), self.color_probs(a, b)
+        pairs = a * self.size + b
+        return tables[0][pairs], tables[1][pairs]
+
+    def cross_summary(self, a: Sequence[int], b: Sequence[int], offspring: bool = True) -> List[Dict[str, Any]]:
+        """
+        Json friendly `cross` of each pair: its color probabilities, in `Flower.flowercolors` order,
+        and unless `offspring` is False every child with its color and probability, in genotype
+        order like `Flower.__add__`.
+        """
+        children, colors = self.cross(a, b)
+        res = []
+        for k, (f1, f2) in enumerate(zip(a, b)):
+            nonzero = np.flatnonzero(colors[k])
+            entry: Dict[str, Any] = {
+                "parents": [self.codes[f1], self.codes[f2]],
+                "colors": dict(zip((Flower.flowercolors[c] for c in nonzero), colors[k, nonzero].tolist())),
+            }
+            if offspring:
+                nonzero = np.flatnonzero(children[k])
+                entry["offspring"] = [
+                    {"code": self.codes[c], "color": self.color_names[c], "prob": p}
+                    for c, p in zip(nonzero.tolist(), children[k, nonzero].tolist())
+                ]
+            res.append(entry)
+        return res
+
+
+@lru_cache(maxsize=None)
+def genetics(flower_type: FlowerType) -> Genetics:
+    """
+    Tensors are built once per species, on first use.
+    """
+    return Genetics(flower_type)
@@ -0,0 +1,1032 @@
+#!/usr/bin/env python3
+
+"""
+File:   genotype.py
+
+Integer-encoded genotype engine.
+
+Every genotype of a species is a small integer: its genes read as a base-3 number
+(3 ** 4 = 81 genotypes for roses). Offspring distributions and color tables are computed
+once per parent pair, on first use, so exploration only manipulates integers and species
+with more genes only pay for the pairs they cross. `Flower` objects are created at the API
+boundary only.
+"""
+
+import math
+import sys
+
+from array import array
+from collections import ChainMap, namedtuple
+from functools import lru_cache, partial, reduce
+from typing import *
+
+from flower.main import (
+    AncestorInfo,
+    ExploreStats,
+    Flower,
+    FlowerPedia,
+    FlowerType,
+    HybridTestInfo,
+    SweepStats,
+    convolve,
+    explore_metrics,
+    gene_factors,
+    gene_layout,
+    get_flower_info,
+)
+
+Genotype = NewType("Genotype", int)
+ColorId = NewType("ColorId", int)
+
+# Index based equivalent of `HybridTestInfo`.
+# unknown, tester: genotypes or None. color: index in `Flower.flowercolors` or None.
+IndexedTest = namedtuple("IndexedTest", "unknown tester prob color")
+
+# Index based equivalent of `AncestorInfo`, `ancestors` is a bitset.
+Entry = namedtuple("Entry", "parents ancestors test micro_prob no_test_global_prob total")
+
+NO_TEST = IndexedTest(None, None, 0.0, None)
+CERTAIN = IndexedTest(None, None, 1.0, None)
+BASE_TEST = IndexedTest(None, None, 1, None)
+
+NONE = 0xFF  # Missing genotype / color in the pedia arrays.
+WIDE_NONE = 0xFFFF  # Same, in the arrays of species with 6 or more genes.
+
+
+def encode(genes: Sequence[int]) -> Genotype:
+    """
+    Base-3 index of a gene sequence. Preserves the lexicographic order of genes.
+    """
+    return Genotype(reduce(lambda acc, g: acc * 3 + g, genes, 0))
+
+
+def decode(index: int, n_genes: int) -> Tuple[int, ...]:
+    genes = []
+    for _ in range(n_genes):
+        index, g = divmod(index, 3)
+        genes.append(g)
+    return tuple(reversed(genes))
+
+
+# Largest species whose pair tables are computed up front (4 genes, 81 x 81 pairs).
+EAGER_SIZE = 3 ** 4
+
+
+class PairTable(dict):
+    """
+    Table of a species indexed by parent pair, whose entries are computed on first access.
+    """
+
+    def __init__(self, fill: Callable[[int], None]):
+        super().__init__()
+        self._fill = fill
+
+    def __missing__(self, pair: int):
+        self._fill(pair)
+        return self[pair]
+
+
+class Species:
+    """
+    Genetic tables of a single flower type, with the genes of its `gene_layout`.
+
+    For every parent pair (i, j) (stored at `i * size + j`), computed together: up front for
+    species of at most `EAGER_SIZE` genotypes, on first access of the pair for larger ones:
+        - `offspring`: ((child, probability), ...) in the same order as `mix_flowers`
+        - `color_probs`: {color: probability of obtaining this color}
+        - `colors`: frozenset of the colors above
+        - `max_prob`: probability of the most probable child
+    Pairs with an unknown parent have no offspring.
+    """
+
+    def __init__(self, flower_type: FlowerType):
+        self.type = flower_type
+        self.n_genes = len(gene_layout(flower_type))
+        self.size = 3 ** self.n_genes
+        # Genotypes of the pedia arrays, one byte up to 5 genes. `none` marks a missing genotype / color.
+        if self.size >= WIDE_NONE:
+            raise ValueError(f"{flower_type} has {self.n_genes} genes, at most 10 are supported.")
+        self.typecode, self.none = ("B", NONE) if self.size < NONE else ("H", WIDE_NONE)
+
+        self.color: List[Optional[ColorId]] = [None] * self.size
+        self.is_seed: List[bool] = [False] * self.size
+        self.is_island: List[bool] = [False] * self.size
+
+        for f, info in get_flower_info().items():
+            if f.type == flower_type:
+                g = encode(f.genes)
+                self.color[g] = Flower.flowercolors.index(info.color)
+                self.is_seed[g] = bool(info.seed)
+                self.is_island[g] = bool(info.island)
+
+        self.known: List[Genotype] = [Genotype(g) for g in range(self.size) if self.color[g] is not None]
+        self._flowers: Dict[int, Flower] = {}
+        self.tests = TestIndex(self)
+
+        self.genes = [decode(g, self.n_genes) for g in range(self.size)]
+        self._best_prob: Optional[float] = None
+
+        if self.size > EAGER_SIZE:
+            self.offspring: Dict[int, Tuple[Tuple[Genotype, float], ...]] = PairTable(self._fill)
+            self.color_probs: Dict[int, Dict[ColorId, float]] = PairTable(self._fill)
+            self.colors: Dict[int, FrozenSet[ColorId]] = PairTable(self._fill)
+            self.max_prob: Dict[int, float] = PairTable(self._fill)
+            return
+
+        # Small species: every pair in plain lists, faster to index in the hot loops.
+        self.offspring = [()] * (self.size ** 2)
+        self.color_probs = [{}] * (self.size ** 2)
+        self.colors = [frozenset()] * (self.size ** 2)
+        self.max_prob = [0.0] * (self.size ** 2)
+        for i in self.known:
+            for j in self.known:
+                self._fill(i * self.size + j)
+
+    def _fill(self, pair: int):
+        i, j = divmod(pair, self.size)
+        if self.color[i] is None or self.color[j] is None:
+            children: Tuple[Tuple[Genotype, float], ...] = ()
+        else:
+            children = tuple((encode(g), p) for g, p in convolve(gene_factors(self.genes[i], self.genes[j])))
+        child_colors = [self.color[c] for c, _ in children]
+
+        # `sum` over the children in order, exactly like `prob_test_hybrid` does.
+        self.color_probs[pair] = {
+            c: sum(p for (_, p), cc in zip(children, child_colors) if cc == c) for c in set(child_colors)
+        }
+        self.colors[pair] = frozenset(child_colors)
+        self.max_prob[pair] = max((p for _, p in children), default=0.0)
+        self.offspring[pair] = children
+
+    @property
+    def best_prob(self) -> float:
+        """
+        Probability of the most probable child of any pair of known flowers. The most probable child
+        of a pair takes the most probable gene of every per-gene distribution, its probability is the
+        product of their maxima: no offspring is enumerated.
+        """
+        if self._best_prob is None:
+            best = 0.0
+            for i in self.known:
+                for j in self.known:
+                    p = 1.0
+                    for dist in gene_factors(self.genes[i], self.genes[j]):
+                        p *= max(q for _, q in dist)
+                    best = max(best, p)
+                if best == 1.0:
+                    break
+            self._best_prob = best
+        return self._best_prob
+
+    def cross(self, i: int, j: int) -> Tuple[Tuple[Genotype, float], ...]:
+        return self.offspring[i * self.size + j]
+
+    def index(self, flower: Flower) -> Genotype:
+        assert flower.type == self.type, f"Expected a flower of type {self.type}, got {flower.type}."
+        return encode(flower.genes)
+
+    def flower(self, index: Optional[int]) -> Optional[Flower]:
+        if index is None:
+            return None
+        if index not in self._flowers:
+            self._flowers[index] = Flower(self.type, decode(index, self.n_genes))
+        return self._flowers[index]
+
+    def color_name(self, color: Optional[int]):
+        return None if color is None else Flower.flowercolors[color]
+
+
+# Best test of a hybrid with one tester: (probability, tester, color).
+RankedTest = Tuple[float, Genotype, ColorId]
+
+
+class TestIndex:
+    """
+    Color tests of a species, filled on first use and shared by every exploration.
+
+    A hybrid `f_h` has look-alikes: its siblings of the same color. The look-alike tuple is in
+    offspring order, that is increasing genotype order. For each (hybrid, look-alikes) the index holds
+    the testers whose cross with `f_h` shows a color none of the look-alikes can give, ranked by
+    decreasing probability then increasing genotype, with their smallest best color. This is the
+    tie-breaking of `flower.main.prob_test_hybrid`, which keeps the first strictly better test.
+    """
+
+    def __init__(self, sp: Species):
+        self.sp = sp
+        self._testers: Dict[Tuple[int, Tuple[int, ...]], List[RankedTest]] = {}
+        self._self_tests: Dict[Tuple[int, Tuple[int, ...]], Tuple[float, Optional[ColorId]]] = {}
+
+    def testers(self, f_h: int, concurrent: Tuple[int, ...]) -> List[RankedTest]:
+        key = (f_h, concurrent)
+        ranked = self._testers.get(key)
+        if ranked is None:
+            ranked = self._testers[key] = self._rank_testers(f_h, concurrent)
+        return ranked
+
+    def _rank_testers(self, f_h: int, concurrent: Tuple[int, ...]) -> List[RankedTest]:
+        sp = self.sp
+        size = sp.size
+        c_h = sp.color[f_h]
+
+        ranked = []
+        for other_f in sp.known:
+            concurrent_colors: Set[int] = set()
+            for ff in concurrent:
+                concurrent_colors |= sp.colors[ff * size + other_f]
+
+            possible_test_colors = sp.colors[f_h * size + other_f] - concurrent_colors
+            if sp.color[other_f] == c_h:
+                possible_test_colors -= {c_h}
+
+            probs = sp.color_probs[f_h * size + other_f]
+            best_p_color = 0.0
+            best_color = None
+            for test_color in sorted(possible_test_colors):
+                if probs[test_color] > best_p_color:
+                    best_p_color = probs[test_color]
+                    best_color = test_color
+            if best_color is not None:
+                ranked.append((best_p_color, other_f, best_color))
+
+        # Stable sort: equally good testers stay in increasing genotype order.
+        ranked.sort(key=lambda t: -t[0])
+        return ranked
+
+    def self_test(self, f_h: int, concurrent: Tuple[int, ...]) -> Tuple[float, Optional[ColorId]]:
+        """
+        Best test of `f_h` with itself: a color of `f_h + f_h` that no look-alike crossed with itself
+        can show, other than the color of `f_h`.
+        """
+        key = (f_h, concurrent)
+        res = self._self_tests.get(key)
+        if res is None:
+            sp = self.sp
+            pair = f_h * sp.size + f_h
+            h_colors = sp.colors[pair]
+            self_probs = sp.color_probs[pair]
+
+            best_p_color = 0.0
+            best_color = None
+            for other_f in concurrent:
+                for test_color in sorted(h_colors - sp.colors[other_f * sp.size + other_f] - {sp.color[f_h]}):
+                    p_color = self_probs.get(test_color, 0)
+                    if p_color > best_p_color:
+                        best_p_color = p_color
+                        best_color = test_color
+            res = self._self_tests[key] = (best_p_color, best_color)
+        return res
+
+    def __len__(self) -> int:
+        return len(self._testers) + len(self._self_tests)
+
+
+@lru_cache(maxsize=None)
+def species(flower_type: FlowerType) -> Species:
+    """
+    Tables are built once per species, on first use.
+    """
+    return Species(flower_type)
+
+
+
+def iter_bits(bits: int) -> Iterator[int]:
+    """
+    Indices of the set bits of an ancestors bitset, in increasing order.
+    """
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class IndexedPedia(Mapping[int, Entry]):
+    """
+    Struct-of-arrays FlowerPedia of a single species, every array is indexed by genotype.
+    Ancestors are bitsets (bit `g` set for genotype `g`), `order` lists known genotypes in discovery order.
+
+    Reading `pedia[g]` builds an `Entry` view, the hot loop reads the arrays directly.
+    """
+
+    __slots__ = (
+        "species", "order", "known", "parent_a", "parent_b", "ancestors",
+        "micro", "no_test", "total", "test_unknown", "test_tester", "test_color", "test_prob",
+    )
+
+    def __init__(self, sp: Species):
+        n, code, none = sp.size, sp.typecode, sp.none
+        self.species = sp
+        self.order = array(code)
+        self.known = bytearray(n)
+        self.parent_a = array(code, [none]) * n
+        self.parent_b = array(code, [none]) * n
+        self.ancestors: List[int] = [0] * n
+        self.micro = array("d", [0.0]) * n
+        self.no_test = array("d", [0.0]) * n
+        # Unknown genotypes have a total probability of 0.
+        self.total = array("d", [0.0]) * n
+        self.test_unknown = array(code, [none]) * n
+        self.test_tester = array(code, [none]) * n
+        self.test_color = array(code, [none]) * n
+        self.test_prob = array("d", [0.0]) * n
+
+    def set(
+        self,
+        f: int,
+        parents: Optional[Tuple[int, int]],
+        ancestors: int,
+        test: IndexedTest,
+        micro_prob: float,
+        no_test_global_prob: float,
+    ):
+        none = self.species.none
+        if not self.known[f]:
+            self.known[f] = 1
+            self.order.append(f)
+        self.parent_a[f], self.parent_b[f] = (none, none) if parents is None else parents
+        self.ancestors[f] = ancestors
+        self.test_unknown[f] = none if test.unknown is None else test.unknown
+        self.test_tester[f] = none if test.tester is None else test.tester
+        self.test_color[f] = none if test.color is None else test.color
+        self.test_prob[f] = test.prob
+        self.micro[f] = micro_prob
+        self.no_test[f] = no_test_global_prob
+        self.total[f] = test.prob * no_test_global_prob
+
+    def copy_entry(self, other: "IndexedPedia", f: int):
+        self.set(f, *other[f][:5])
+
+    def __getitem__(self, f: int) -> Entry:
+        if not (0 <= f < len(self.known) and self.known[f]):
+            raise KeyError(f)
+        none = self.species.none
+        a, b = self.parent_a[f], self.parent_b[f]
+        unknown, tester, color = self.test_unknown[f], self.test_tester[f], self.test_color[f]
+        return Entry(
+            None if a == none else (a, b),
+            self.ancestors[f],
+            IndexedTest(
+                None if unknown == none else unknown,
+                None if tester == none else tester,
+                self.test_prob[f],
+                None if color == none else color,
+            ),
+            self.micro[f],
+            self.no_test[f],
+            self.total[f],
+        )
+
+    def __contains__(self, f) -> bool:
+        return isinstance(f, int) and 0 <= f < len(self.known) and bool(self.known[f])
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.order)
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def subset(self, genotypes: Iterable[int]) -> "IndexedPedia":
+        res = IndexedPedia(self.species)
+        for f in genotypes:
+            res.copy_entry(self, f)
+        return res
+
+    def nbytes(self) -> int:
+        """
+        Approximate memory footprint of the arrays.
+        """
+        arrays = (
+            self.order, self.known, self.parent_a, self.parent_b, self.micro, self.no_test,
+            self.total, self.test_unknown, self.test_tester, self.test_color, self.test_prob,
+        )
+        return sum(sys.getsizeof(a) for a in arrays) + sys.getsizeof(self.ancestors) + sum(
+            sys.getsizeof(self.ancestors[f]) for f in self.order
+        )
+
+    def view(self) -> "FlowerPediaView":
+        return FlowerPediaView(self)
+
+    @classmethod
+    def from_flowerpedia(cls, sp: Species, flowerpedia: Mapping[Flower, AncestorInfo]) -> "IndexedPedia":
+        """
+        Inverse of `to_flowerpedia`.
+        """
+        if isinstance(flowerpedia, FlowerPediaView) and flowerpedia.pedia.species is sp:
+            return flowerpedia.pedia.subset(flowerpedia.pedia.order)
+
+        def index(f: Optional[Flower]) -> Optional[int]:
+            return None if f is None else sp.index(f)
+
+        res = cls(sp)
+        for f, info in flowerpedia.items():
+            test = info.test
+            res.set(
+                sp.index(f),
+                None if info.parents is None else (sp.index(info.parents[0]), sp.index(info.parents[1])),
+                sum(1 << sp.index(a) for a in info.ancestors),
+                IndexedTest(
+                    index(test.unknown_flower),
+                    index(test.test_flower),
+                    test.test_prob,
+                    None if test.test_color is None else Flower.flowercolors.index(test.test_color),
+                ),
+                info.micro_prob,
+                info.no_test_global_prob,
+            )
+        return res
+
+    def to_flowerpedia(self) -> FlowerPedia:
+        """
+        Plain dict FlowerPedia, as `flower.main.explore` builds it.
+        """
+        return FlowerPedia(dict(self.view().items()))
+
+
+def ancestor_info(sp: Species, e: Entry) -> AncestorInfo:
+    return AncestorInfo(
+        parents=None if e.parents is None else (sp.flower(e.parents[0]), sp.flower(e.parents[1])),
+        ancestors={sp.flower(a) for a in iter_bits(e.ancestors)},
+        test=HybridTestInfo(
+            unknown_flower=sp.flower(e.test.unknown),
+            test_flower=sp.flower(e.test.tester),
+            test_prob=e.test.prob,
+            test_color=sp.color_name(e.test.color),
+        ),
+        micro_prob=e.micro_prob,
+        no_test_global_prob=e.no_test_global_prob,
+    )
+
+
+class FlowerPediaView(Mapping[Flower, AncestorInfo]):
+    """
+    FlowerPedia interface (Flower -> AncestorInfo) over an `IndexedPedia`.
+    `AncestorInfo` objects are built on access and not kept.
+    """
+
+    __slots__ = ("pedia",)
+
+    def __init__(self, pedia: IndexedPedia):
+        self.pedia = pedia
+
+    def _index(self, flower) -> Optional[int]:
+        sp = self.pedia.species
+        if not isinstance(flower, Flower) or flower.type != sp.type:
+            return None
+        return encode(flower.genes)
+
+    def __getitem__(self, flower: Flower) -> AncestorInfo:
+        f = self._index(flower)
+        if f is None or f not in self.pedia:
+            raise KeyError(flower)
+        return ancestor_info(self.pedia.species, self.pedia[f])
+
+    def __contains__(self, flower) -> bool:
+        f = self._index(flower)
+        return f is not None and f in self.pedia
+
+    def __iter__(self) -> Iterator[Flower]:
+        sp = self.pedia.species
+        return (sp.flower(f) for f in self.pedia.order)
+
+    def __len__(self) -> int:
+        return len(self.pedia)
+
+
+def prob_test_hybrid(sp: Species, f1: int, f2: int, f_h: int, known_flowers: int) -> IndexedTest:
+    """
+    Index based `flower.main.prob_test_hybrid`, same results and same tie-breaking.
+    `known_flowers` is an ancestors bitset.
+    """
+    color = sp.color
+    size = sp.size
+    c_h = color[f_h]
+
+    if color[f1] == color[f2] == c_h:
+        return NO_TEST
+
+    f12 = sp.offspring[f1 * size + f2]
+    concurrent_flowers = tuple(f for f, _ in f12 if color[f] == c_h and f != f_h)
+    if not concurrent_flowers:
+        return CERTAIN
+
+    best_test_f = None
+    best_p_color = 0.0
+    best_color = None
+
+    # Most probable test among the known testers.
+    for p_color, other_f, test_color in sp.tests.testers(f_h, concurrent_flowers):
+        if known_flowers >> other_f & 1:
+            best_p_color, best_test_f, best_color = p_color, other_f, test_color
+            break
+
+    # Self hybridation, only kept when strictly better.
+    p_color, test_color = sp.tests.self_test(f_h, concurrent_flowers)
+    if p_color > best_p_color:
+        best_p_color, best_test_f, best_color = p_color, f_h, test_color
+
+    return IndexedTest(f_h, best_test_f, best_p_color, best_color)
+
+
+def relax_pair(
+    sp: Species,
+    flowerpedia: IndexedPedia,
+    f1: int,
+    f2: int,
+    updated: Set[int],
+    settled: int = 0,
+    sweep: Optional[SweepStats] = None,
+) -> None:
+    """
+    Cross `f1` and `f2` and record every offspring whose best known probability improves.
+    Improved genotypes are added to `updated`, genotypes of the `settled` bitset are never modified.
+    """
+    if sweep is not None:
+        sweep.pairs += 1
+    ancestors = flowerpedia.ancestors
+    total = flowerpedia.total
+    a1 = ancestors[f1]
+    a2 = ancestors[f2]
+
+    # Flowers needed by both parents are counted twice in `total[f1] * total[f2]`
+    divisor = 1.0
+    pred_common = a1 & a2
+    if pred_common:
+        micro, test_prob = flowerpedia.micro, flowerpedia.test_prob
+        for fi in iter_bits(pred_common):
+            divisor *= micro[fi] * test_prob[fi]
+    prob_common = total[f1] * total[f2] / divisor
+
+    h_ancestors = a1 | a2 | 1 << f1 | 1 << f2
+    for f, p in sp.offspring[f1 * sp.size + f2]:
+        if f == f1 or f == f2 or settled >> f & 1:
+            continue
+        # Unknown genotypes have a total of 0 and are never skipped.
+        if prob_common < total[f]:
+            continue
+
+        test_result = prob_test_hybrid(sp, f1, f2, f, h_ancestors)
+        if sweep is not None:
+            sweep.prob_test_hybrid_calls += 1
+
+        prob_f = prob_common * p * test_result.prob
+        if prob_f > 0 and total[f] < prob_f:
+            flowerpedia.set(f, (f1, f2), h_ancestors, test_result, p, prob_common * p)
+            updated.add(f)
+            if sweep is not None:
+                sweep.relaxations += 1
+
+
+def relax_pair_bounded(
+    sp: Species,
+    flowerpedia: IndexedPedia,
+    f1: int,
+    f2: int,
+    updated: Set[int],
+    sweep: Optional[SweepStats] = None,
+    *,
+    floor: array,
+) -> None:
+    """
+    `relax_pair` skipping the pairs that cannot improve any of their offspring.
+
+    An offspring `f` obtained with probability `p` is only improved when `prob_common * p * test_prob`
+    beats `total[f]`, where `test_prob <= 1`. `floor[pair]` is the lowest `total` of the offspring of
+    the pair when it was last crossed: best probabilities only grow, so it stays a lower bound of the
+    current one, and a pair with `prob_common * max_prob <= floor` is skipped before being crossed.
+    Offspring are skipped on `prob_common * p <= total[f]` rather than `prob_common < total[f]`.
+    Both bounds are admissible: the FlowerPedia is the one of `relax_pair`.
+    """
+    ancestors = flowerpedia.ancestors
+    total = flowerpedia.total
+    a1 = ancestors[f1]
+    a2 = ancestors[f2]
+
+    divisor = 1.0
+    pred_common = a1 & a2
+    if pred_common:
+        micro, test_prob = flowerpedia.micro, flowerpedia.test_prob
+        for fi in iter_bits(pred_common):
+            divisor *= micro[fi] * test_prob[fi]
+    prob_common = total[f1] * total[f2] / divisor
+
+    pair = f1 * sp.size + f2
+    if prob_common * sp.max_prob[pair] <= floor[pair]:
+        if sweep is not None:
+            sweep.pruned += 1
+        return
+    if sweep is not None:
+        sweep.pairs += 1
+
+    lowest = math.inf
+    h_ancestors = a1 | a2 | 1 << f1 | 1 << f2
+    for f, p in sp.offspring[pair]:
+        if f == f1 or f == f2:
+            continue
+        total_f = total[f]
+        if prob_common * p > total_f:
+            test_result = prob_test_hybrid(sp, f1, f2, f, h_ancestors)
+            if sweep is not None:
+                sweep.prob_test_hybrid_calls += 1
+
+            prob_f = prob_common * p * test_result.prob
+            if prob_f > 0 and total_f < prob_f:
+                flowerpedia.set(f, (f1, f2), h_ancestors, test_result, p, prob_common * p)
+                updated.add(f)
+                total_f = total[f]
+                if sweep is not None:
+                    sweep.relaxations += 1
+        if total_f < lowest:
+            lowest = total_f
+    floor[pair] = lowest
+
+
+def base_pedia(sp: Species, base_flowers: Sequence[int]) -> IndexedPedia:
+    flowerpedia = IndexedPedia(sp)
+    for f in base_flowers:
+        if f not in flowerpedia:
+            flowerpedia.set(f, None, 0, BASE_TEST, 1.0, 1.0)
+    return flowerpedia
+
+
+def explore_indices(sp: Species, base_flowers: Sequence[int], stats: Optional[ExploreStats] = None) -> IndexedPedia:
+    """
+    Index based `flower.main.explore`. Visits pairs in the same order and yields the same FlowerPedia.
+    """
+    stats = explore_metrics.stats("genotype", stats)
+    flowerpedia = base_pedia(sp, base_flowers)
+    propagate(sp, flowerpedia, set(base_flowers), stats)
+    explore_metrics.record(stats)
+    return flowerpedia
+
+
+def propagate(
+    sp: Species,
+    flowerpedia: IndexedPedia,
+    new_flowers: Set[int],
+    stats: Optional[ExploreStats] = None,
+    relax: Callable[..., None] = relax_pair,
+    until: Optional[Callable[[IndexedPedia, Set[int]], bool]] = None,
+):
+    """
+    Sweeps of `explore`: cross every known flower with every new flower until nothing improves,
+    or until `until(flowerpedia, new_flowers)` is true after a sweep.
+    """
+    sweep = None
+    next_new_flowers: Set[int] = set()
+
+    while new_flowers:
+        sorted_new = sorted(new_flowers)
+        if stats is not None:
+            sweep = stats.start_sweep()
+
+        for f1 in list(flowerpedia.order):
+            f1_is_new = f1 in new_flowers
+            for f2 in sorted_new:
+                if f1_is_new and f1 > f2:
+                    continue
+                relax(sp, flowerpedia, f1, f2, next_new_flowers, sweep=sweep)
+
+        new_flowers = next_new_flowers
+        next_new_flowers = set()
+        if sweep is not None:
+            stats.end_sweep(sweep)
+        if until is not None and new_flowers and until(flowerpedia, new_flowers):
+            break
+
+
+def sweep_bound(sp: Species, flowerpedia: IndexedPedia, new_flowers: Set[int]) -> float:
+    """
+    Upper bound of the `total` of the offspring of the next sweep.
+
+    A cross of a new flower `n` with `f1` has `prob_common <= total[n] * total[f1] / weights(f1)`,
+    `weights(f1)` being the product of `micro * test_prob` over all the ancestors of `f1`. The next
+    sweep offspring are bounded by that times the most probable child of the species.
+
+    This bound only holds for the next sweep. Later sweeps cross flowers it bounds, but `weights`
+    are read from the current entries of the ancestors: when an ancestor gets a better plan with a
+    lower `micro * test_prob`, the ratio of its descendants grows past the bound. Stopping on it is
+    a heuristic (see `explore_bounded`).
+    """
+    total, ancestors = flowerpedia.total, flowerpedia.ancestors
+    micro, test_prob = flowerpedia.micro, flowerpedia.test_prob
+
+    ratio = 0.0
+    for f1 in flowerpedia.order:
+        weights = 1.0
+        for fi in iter_bits(ancestors[f1]):
+            weights *= micro[fi] * test_prob[fi]
+        ratio = max(ratio, total[f1] / weights)
+
+    return max(total[n] for n in new_flowers) * ratio * sp.best_prob
+
+
+def settled(sp: Species, flowerpedia: IndexedPedia, new_flowers: Set[int], targets: Sequence[int]) -> bool:
+    """
+    Whether the next sweep cannot improve `targets`, nor any flower of their plans (see `sweep_bound`).
+    """
+    total, ancestors = flowerpedia.total, flowerpedia.ancestors
+
+    needed = 0
+    todo = list(targets)
+    while todo:
+        f = todo.pop()
+        if not flowerpedia.known[f]:
+            return False
+        if needed >> f & 1:
+            continue
+        needed |= 1 << f
+        todo.extend(iter_bits(ancestors[f] & ~needed))
+    lowest = min(total[f] for f in iter_bits(needed))
+
+    return sweep_bound(sp, flowerpedia, new_flowers) <= lowest
+
+
+def settled_first(sp: Species, flowerpedia: IndexedPedia, new_flowers: Set[int], targets: Sequence[int]) -> bool:
+    """
+    Whether the most probable known genotype of `targets` is `settled` and stays the most probable:
+    the next sweep cannot find a target of the same probability either.
+    """
+    known = [f for f in targets if flowerpedia.known[f]]
+    if not known:
+        return False
+    best = max(known, key=flowerpedia.total.__getitem__)
+    return sweep_bound(sp, flowerpedia, new_flowers) < flowerpedia.total[best] and settled(
+        sp, flowerpedia, new_flowers, [best]
+    )
+
+
+def explore_bounded(
+    sp: Species,
+    base_flowers: Sequence[int],
+    targets: Optional[Sequence[int]] = None,
+    stats: Optional[ExploreStats] = None,
+    stop_at_first: bool = False,
+) -> IndexedPedia:
+    """
+    Branch and bound `explore_indices`, see `relax_pair_bounded`: same FlowerPedia, fewer crosses.
+
+    With `targets`, stops as soon as they are `settled` (with `stop_at_first`, as soon as the most
+    probable one is, see `settled_first`), other genotypes may not be final. This early stop is
+    approximate: `sweep_bound` only bounds the next sweep, a later one may still improve the plan of
+    a target. It gives the entries of the full exploration for every color of every DB partition
+    (`python -m flower check-engines`), not necessarily for other base flowers.
+    """
+    stats = explore_metrics.stats("bounded", stats)
+    flowerpedia = base_pedia(sp, base_flowers)
+    floor = array("d", [0.0]) * (sp.size ** 2)
+    until = None
+    if targets is not None:
+        until = partial(settled_first if stop_at_first else settled, sp, targets=targets)
+    propagate(
+        sp, flowerpedia, set(base_flowers), stats, relax=partial(relax_pair_bounded, floor=floor), until=until
+    )
+    explore_metrics.record(stats)
+    return flowerpedia
+
+
+class RankedPedia:
+    """
+    FlowerPedia of `explore_top_k`. `pedia` holds the best plan of every genotype, exactly as
+    `explore_indices` finds it, `alternatives[g]` up to k - 1 runner-up plans of genotype `g`, best
+    first, each made of a different pair of parents. Parents of a runner-up use their best plan.
+    """
+
+    __slots__ = ("pedia", "k", "alternatives")
+
+    def __init__(self, pedia: IndexedPedia, k: int):
+        self.pedia = pedia
+        self.k = k
+        self.alternatives: List[List[Entry]] = [[] for _ in range(pedia.species.size)]
+
+    def plans(self, f: int) -> List[Entry]:
+        """
+        Plans of `f` by decreasing probability. Runner-ups whose parents now need `f` itself
+        (their best plan improved after the runner-up was recorded) are left out.
+        """
+        if f not in self.pedia:
+            return []
+        res = [self.pedia[f]]
+        for e in self.alternatives[f]:
+            if not self.needs(e.parents, f):
+                res.append(e)
+        return res
+
+    def needs(self, parents: Tuple[int, int], f: int) -> bool:
+        parent_a, parent_b = self.pedia.parent_a, self.pedia.parent_b
+        seen = set()
+        todo = list(parents)
+        while todo:
+            g = todo.pop()
+            if g == f:
+                return True
+            if g in seen or parent_a[g] == self.pedia.species.none:
+                continue
+            seen.add(g)
+            todo += (parent_a[g], parent_b[g])
+        return False
+
+    def flowerpedia(self, f: int, rank: int) -> Mapping[Flower, AncestorInfo]:
+        """
+        FlowerPedia where `f` is obtained with its plan of rank `rank` (see `plans`).
+        """
+        sp = self.pedia.species
+        return ChainMap({sp.flower(f): ancestor_info(sp, self.plans(f)[rank])}, self.pedia.view())
+
+    def nbytes(self) -> int:
+        return self.pedia.nbytes() + sum(
+            sys.getsizeof(alts) + sum(sys.getsizeof(e) + sys.getsizeof(e.test) for e in alts)
+            for alts in self.alternatives
+        )
+
+
+def relax_pair_top_k(
+    sp: Species,
+    flowerpedia: IndexedPedia,
+    f1: int,
+    f2: int,
+    updated: Set[int],
+    sweep: Optional[SweepStats] = None,
+    *,
+    ranked: RankedPedia,
+) -> None:
+    """
+    `relax_pair` also keeping the k - 1 best other pairs of parents of every offspring in `ranked`.
+    Best plans are updated exactly as `relax_pair` does.
+    """
+    if sweep is not None:
+        sweep.pairs += 1
+    k = ranked.k
+    alternatives = ranked.alternatives
+    ancestors = flowerpedia.ancestors
+    total = flowerpedia.total
+    parent_a, parent_b = flowerpedia.parent_a, flowerpedia.parent_b
+    a1 = ancestors[f1]
+    a2 = ancestors[f2]
+
+    divisor = 1.0
+    pred_common = a1 & a2
+    if pred_common:
+        micro, test_prob = flowerpedia.micro, flowerpedia.test_prob
+        for fi in iter_bits(pred_common):
+            divisor *= micro[fi] * test_prob[fi]
+    prob_common = total[f1] * total[f2] / divisor
+
+    pair = {f1, f2}
+    h_ancestors = a1 | a2 | 1 << f1 | 1 << f2
+    for f, p in sp.offspring[f1 * sp.size + f2]:
+        if f == f1 or f == f2:
+            continue
+        # Offspring probability is at most `prob_common`: skip it when it cannot be among the k best.
+        alts = alternatives[f]
+        if k == 1:
+            floor = total[f]
+        else:
+            floor = alts[-1].total if len(alts) == k - 1 else 0.0
+        if prob_common < floor:
+            continue
+
+        test_result = prob_test_hybrid(sp, f1, f2, f, h_ancestors)
+        if sweep is not None:
+            sweep.prob_test_hybrid_calls += 1
+
+        prob_f = prob_common * p * test_result.prob
+        if prob_f <= 0:
+            continue
+        same_pair = {parent_a[f], parent_b[f]} == pair
+
+        if total[f] < prob_f:
+            # New best plan, the previous one becomes the first runner-up.
+            alts = [e for e in alts if set(e.parents) != pair]
+            if parent_a[f] != sp.none and not same_pair:
+                alts.insert(0, flowerpedia[f])
+            alternatives[f] = alts[: k - 1]
+            flowerpedia.set(f, (f1, f2), h_ancestors, test_result, p, prob_common * p)
+            updated.add(f)
+            if sweep is not None:
+                sweep.relaxations += 1
+            continue
+
+        # Runner-up: a different pair of parents, which does not need `f` itself.
+        if k == 1 or same_pair or h_ancestors >> f & 1:
+            continue
+        existing = next((i for i, e in enumerate(alts) if set(e.parents) == pair), None)
+        if existing is not None:
+            if alts[existing].total >= prob_f:
+                continue
+            del alts[existing]
+        elif len(alts) == k - 1 and alts[-1].total >= prob_f:
+            continue
+
+        # Equally probable plans stay in discovery order.
+        i = 0
+        while i < len(alts) and alts[i].total >= prob_f:
+            i += 1
+        alts.insert(i, Entry((f1, f2), h_ancestors, test_result, p, prob_common * p, prob_f))
+        del alts[k - 1 :]
+
+
+def explore_top_k(
+    sp: Species, base_flowers: Sequence[int], k: int, stats: Optional[ExploreStats] = None
+) -> RankedPedia:
+    """
+    `explore_indices` keeping the `k` best plans of every genotype, see `RankedPedia`.
+    """
+    assert k >= 1, f"Expected k >= 1, got {k}."
+    stats = explore_metrics.stats("top_k", stats)
+    ranked = RankedPedia(base_pedia(sp, base_flowers), k)
+    propagate(sp, ranked.pedia, set(base_flowers), stats, relax=partial(relax_pair_top_k, ranked=ranked))
+    explore_metrics.record(stats)
+    return ranked
+
+
+def explore(base_flowers: List[Flower], stats: Optional[ExploreStats] = None) -> FlowerPedia:
+    """
+    Drop-in replacement for `flower.main.explore` running on genotype indices.
+    """
+    if not base_flowers:
+        return FlowerPedia({})
+    sp = species(base_flowers[0].type)
+    return explore_indices(sp, [sp.index(f) for f in base_flowers], stats).to_flowerpedia()
+
+
+def explore_view(base_flowers: List[Flower]) -> Mapping[Flower, AncestorInfo]:
+    """
+    Like `explore`, but AncestorInfo are only built when read.
+    """
+    if not base_flowers:
+        return FlowerPedia({})
+    sp = species(base_flowers[0].type)
+    return explore_indices(sp, [sp.index(f) for f in base_flowers]).view()
+
+
+def search(
+    base_flowers: List[Flower],
+    targets: Optional[List[Flower]] = None,
+    stop_at_first: bool = False,
+    stats: Optional[ExploreStats] = None,
+) -> FlowerPedia:
+    """
+    FlowerPedia of `explore_bounded`, the one of `explore` without `targets`. With `targets`, only
+    the targets found (the most probable one with `stop_at_first`) and the flowers of their plans,
+    for low-latency queries: their entries are approximate, see `explore_bounded`.
+    """
+    if not base_flowers:
+        return FlowerPedia({})
+    sp = species(base_flowers[0].type)
+    indices = None if targets is None else [sp.index(f) for f in targets]
+    flowerpedia = explore_bounded(sp, [sp.index(f) for f in base_flowers], indices, stats, stop_at_first)
+    if indices is None:
+        return flowerpedia.to_flowerpedia()
+
+    found = [f for f in indices if flowerpedia.known[f]]
+    if stop_at_first and found:
+        found = [max(found, key=flowerpedia.total.__getitem__)]
+    needed = 0
+    for f in found:
+        needed |= 1 << f | flowerpedia.ancestors[f]
+    return flowerpedia.subset(f for f in flowerpedia.order if needed >> f & 1).to_flowerpedia()
+
+
+def ancestors(
+    tgt: int, flowerpedia: IndexedPedia, mem: Optional[Dict[int, Dict]] = None
+) -> Dict[str, Any]:
+    """
+    Index based `flower.main.ancestors`, produces the same tree.
+    """
+    if mem is None:
+        mem = {}
+    if tgt in mem:
+        return mem[tgt]
+
+    sp = flowerpedia.species
+    tgt_f = sp.flower(tgt)
+    tgt_info = flowerpedia[tgt]
+
+    if tgt_info.parents is None:
+        return {"color": tgt_f.color, "code": tgt_f.code}
+
+    p1, p2 = tgt_info.parents
+
+    a1 = ancestors(p1, flowerpedia, mem)
+    mem[p1] = a1
+
+    a2 = ancestors(p2, flowerpedia, mem)
+    mem[p2] = a2
+
+    test = tgt_info.test
+    unknown_f, test_f = sp.flower(test.unknown), sp.flower(test.tester)
+    return {
+        "code": tgt_f.code,
+        "A": a1,
+        "B": a2 if p1 != p2 else None,
+        "prob": f"{tgt_info.micro_prob:.03}",
+        "total_prob": f"{tgt_info.total:.03}",
+        "color": tgt_f.color,
+        "test": {
+            "unknown_flower_code": unknown_f.code,
+            "unknown_flower_color": unknown_f.color,
+            "test_flower_code": test_f.code,
+            "test_flower_color": test_f.color,
+            "test_prob": test.prob,
+            "test_color": sp.color_name(test.color),
+        } if test.tester is not None and test.unknown is not None else None,
+    }
@@ -10,10 +10,14 @@ mail:   douzont@gmail.com
 
 
 import argparse
+import hashlib
 import itertools as it
 import json
 import math
-import pickle
+import os
+import struct
+import threading
+import time
 import warnings
 
 from collections import deque, namedtuple, Counter
@@ -27,6 +31,11 @@ from typing import *
 # This code uses informations provided by this source: https://docs.google.com/document/d/1ARIQCUc5YVEd01D7jtJT9EEJF45m07NXhAm4fOpNvCs/mobilebasic
 # All flowers rules are explained deeply an thoroughly inside.
 
+# Resolved from the package location, not from the current working directory.
+ROOT_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+DATA_DIR = path.join(ROOT_DIR, "data")
+DB_DIR = path.join(ROOT_DIR, "db")
+
 FlowerType = NewType("FlowerType", str)
 FlowerColor = NewType("FlowerColor", str)
 ColorSeedIsland = namedtuple("ColorSeedIsland", "color seed island")
@@ -46,23 +55,42 @@ mix_d = {
 }
 
 
-@lru_cache(maxsize=81 ** 2 + 27 ** 2)
-def mix_flowers(f1, f2):
+# Offspring distributions of the pairs last crossed by `mix_flowers`. Explorations of the largest
+# species cross up to (3 ** n_genes) ** 2 pairs: set it to that to keep every pair cached.
+MIX_CACHE_SIZE = int(os.environ.get("FLOWER_MIX_CACHE_SIZE", 2 ** 13))
+
+GeneFactors = Tuple[List[Tuple[int, float]], ...]
+
+
+def gene_factors(f1: Sequence[int], f2: Sequence[int]) -> GeneFactors:
     """
-    Memoized flower hybridation for speedup. Equivalent to a lookup table.
-    Do not use as is, use Flower's addition to combine Flowers.
+    Offspring distribution of two gene sequences in factorized form: genes are inherited
+    independently, one `mix_d` distribution per gene.
     """
-    res_genes = (mix_d[g] for g in zip(f1, f2))
+    return tuple(mix_d[g] for g in zip(f1, f2))
 
-    res = []
-    for p in it.product(*res_genes):
-        genes, probs = zip(*p)
-        prob = reduce(mul, probs)
-        res.append((genes, prob))
 
+def convolve(factors: GeneFactors) -> List[Tuple[Tuple[int, ...], float]]:
+    """
+    Joint distribution of independent per-gene distributions, built gene by gene: children sharing
+    their first genes share the product of their probabilities. Children are in `it.product` order
+    and probabilities are multiplied from the first gene to the last, like `reduce(mul, probs)`.
+    """
+    res: List[Tuple[Tuple[int, ...], float]] = [((), 1.0)]
+    for dist in factors:
+        res = [(genes + (g,), p * q) for genes, p in res for g, q in dist]
     return res
 
 
+@lru_cache(maxsize=MIX_CACHE_SIZE)
+def mix_flowers(f1, f2):
+    """
+    Memoized flower hybridation for speedup. Equivalent to a lookup table.
+    Do not use as is, use Flower's addition to combine Flowers.
+    """
+    return convolve(gene_factors(f1, f2))
+
+
 class Flower:
 
     COSMOS = FlowerType("__COSMOS__")
@@ -100,6 +128,7 @@ class Flower:
     flowercolors = [BLACK, BLUE, GREEN, PINK, PURPLE, ORANGE, RED, YELLOW, WHITE]
 
     # r y o w s
+    # Genes of the flower types without gene data. Others use the genes of their csv file, see `gene_layout`.
     flower_unused_gene: Dict[FlowerType, List[int]] = {
         COSMOS: [-3, -2],
         HYACINTHS: [-3, -1],
@@ -115,11 +144,12 @@ class Flower:
     def __init__(self, flower_type: FlowerType, genes: Sequence[int]):
         """
         Create a Flower based on its genes.
-        Genes are represented by a sequence of 3 or 4 integers 0⩽x_i⩽2
+        Genes are represented by a sequence of integers 0⩽x_i⩽2, one per gene of `gene_layout(flower_type)`
         """
         if flower_type == Flower.VIOLETS:
             warnings.warn(f"Flower type {flower_type} is not supported, gene data is missing in csv file.")
-        assert len(genes) == 5 - len(Flower.flower_unused_gene[flower_type]), f"Expected genes length of {5 - len(Flower.flower_unused_gene[flower_type])}, got {len(genes)} instead."
+        n_genes = len(gene_layout(flower_type))
+        assert len(genes) == n_genes, f"Expected genes length of {n_genes}, got {len(genes)} instead."
         
         self.type = flower_type
         self.genes = tuple(genes)
@@ -128,33 +158,21 @@ class Flower:
 
     @property
     def color(self) -> FlowerColor:
-        return FlowerColor(flower_info[self].color)
+        return FlowerColor(get_flower_info()[self].color)
 
     @property
     def is_seed(self) -> bool:
-        return bool(flower_info[self].seed)
+        return bool(get_flower_info()[self].seed)
 
     @property
     def is_island(self) -> bool:
-        return bool(flower_info[self].island)
+        return bool(get_flower_info()[self].island)
 
     @property
     def code(self) -> str:
-        gene_name = [
-            "rr Rr RR".split(),
-            "yy Yy YY".split(),
-            "oo Oo OO".split(),  # Replaces Y gene for Windflowers.
-            "WW Ww ww".split(),  # 0 is dominant over 2 for W gene.
-            "ss Ss SS".split(),
-        ]
-
-        # Some flowers don't use all genes.
-        for i in Flower.flower_unused_gene[self.type]:
-            del gene_name[i]
-
         res = []
-        for i, g in enumerate(self.genes):
-            res.append(gene_name[i][g])
+        for letter, g in zip(gene_layout(self.type), self.genes):
+            res.append(gene_names(letter)[g])
 
         return " ".join(res)
 
@@ -192,6 +210,48 @@ class Flower:
 
 FlowerDB = NewType("FlowerDB", Dict[Flower, ColorSeedIsland])
 
+# Gene letters of a flower type, in gene order: ("r", "y", "w", "s") for roses.
+GeneLayout = Tuple[str, ...]
+GENE_LETTERS = "ryows"
+
+_gene_layouts: Dict[FlowerType, GeneLayout] = {}
+
+
+def default_gene_layout(flower_type: FlowerType) -> GeneLayout:
+    """
+    Genes of `Flower.flower_unused_gene`, for flower types without gene data.
+    """
+    unused = {i % len(GENE_LETTERS) for i in Flower.flower_unused_gene[flower_type]}
+    return tuple(letter for i, letter in enumerate(GENE_LETTERS) if i not in unused)
+
+
+def gene_layout(flower_type: FlowerType) -> GeneLayout:
+    """
+    Genes of a flower type, as written in its csv file (or compiled in the bundle).
+    Loading flower data registers the layout of every type before creating its flowers.
+    """
+    layout = _gene_layouts.get(flower_type)
+    if layout is None:
+        get_flower_info()
+        layout = _gene_layouts.get(flower_type) or default_gene_layout(flower_type)
+    return layout
+
+
+@lru_cache(maxsize=None)
+def gene_names(letter: str) -> List[str]:
+    """
+    Codes of the 3 genotypes of a gene: "rr Rr RR". 0 is dominant over 2 for the W gene: "WW Ww ww".
+    """
+    names = [letter * 2, letter.upper() + letter, letter.upper() * 2]
+    return names[::-1] if letter == "w" else names
+
+
+def sort_colors(colors: Iterable[FlowerColor]) -> List[FlowerColor]:
+    """
+    Order colors like `Flower.flowercolors` so that set iteration never depends on hash randomization.
+    """
+    return sorted(colors, key=Flower.flowercolors.index)
+
 
 def read_code(code: str) -> tuple:
     code = code.replace(" ", "")
@@ -208,53 +268,275 @@ def read_code(code: str) -> tuple:
     return tuple(gene_code)
 
 
+FlowerRow = Tuple[Tuple[int, ...], ColorSeedIsland]
+
+
+def parse_flower_csv(file: str, flower_type: FlowerType) -> Tuple[GeneLayout, List[FlowerRow], List[str]]:
+    """
+    Gene layout of a flower csv file, its rows in file order, and the errors found in the file.
+    Every line is split once: "id,genes,...,Color (seed)". Rows without genes are left out.
+    The layout is the gene letters of the first row ("rryyWWss": r, y, w, s), that every row
+    must follow. Files without genes get the default layout of their flower type.
+    """
+    rows: List[FlowerRow] = []
+    errors: List[str] = []
+    layout: Optional[GeneLayout] = None
+
+    with open(path.join(DATA_DIR, file), "r") as fp:
+        for n, line in enumerate(fp, 1):
+            fields = line.strip().split(",")
+            if len(fields) < 3:
+                errors.append(f"{file}:{n}: expected at least 3 columns, got {len(fields)}")
+                continue
+            gene, color_info = fields[1], fields[-1].split()
+            if not gene:
+                continue
+
+            if layout is None:
+                layout = tuple(gene[::2].lower())
+                if len(set(layout)) != len(layout) or not all(letter.isalpha() for letter in layout):
+                    errors.append(f"{file}:{n}: invalid gene layout {gene!r}")
+            genes = read_code(gene)
+            if len(gene) != 2 * len(layout) or any(
+                gene[2 * i : 2 * i + 2].lower() != letter * 2 for i, letter in enumerate(layout)
+            ):
+                errors.append(f"{file}:{n}: expected genes {''.join(layout)}, got {gene!r}")
+                continue
+            if not color_info or color_info[0] not in Flower.flowercolors:
+                errors.append(f"{file}:{n}: unknown color {fields[-1]!r}")
+                continue
+            origin = color_info[1] if len(color_info) > 1 else None
+            if origin not in (None, "(seed)", "(island)"):
+                errors.append(f"{file}:{n}: unknown origin {origin!r}")
+                continue
+
+            info = ColorSeedIsland(FlowerColor(color_info[0]), origin == "(seed)", origin == "(island)")
+            rows.append((genes, info))
+
+    return layout or default_gene_layout(flower_type), rows, errors
+
+
 def load_flower_info(file_type_couples: List[Tuple[str, FlowerType]]) -> FlowerDB:
     """
-    Reads a csv file containing color information about flowers.
+    Reads csv files containing color information about flowers.
     """
     d = FlowerDB({})
+    for file, flower_type in file_type_couples:
+        layout, rows, _ = parse_flower_csv(file, flower_type)
+        _gene_layouts[flower_type] = layout
+        for genes, info in rows:
+            d[Flower(flower_type, genes)] = info
+    return d
+
+
+flower_files = [
+    ("cosmos.csv", Flower.COSMOS),
+    ("hyacinths.csv", Flower.HYACINTHS),
+    ("lilies.csv", Flower.LILIES),
+    ("mums.csv", Flower.MUMS),
+    ("pansies.csv", Flower.PANSIES),
+    ("roses.csv", Flower.ROSES),
+    ("tulips.csv", Flower.TULIPS),
+    ("violets.csv", Flower.VIOLETS),
+    ("windflowers.csv", Flower.WINDFLOWERS),
+]
+
+
+@lru_cache(maxsize=None)
+def data_digest() -> bytes:
+    """
+    Hash of every csv of `flower_files` (computed once, like `flower_info`).
+    """
+    h = hashlib.sha256()
+    for file, _ in flower_files:
+        h.update(file.encode())
+        with open(path.join(DATA_DIR, file), "rb") as fp:
+            h.update(fp.read())
+    return h.digest()
+
+
+# Compiled `flower_files`, see `compile_flower_bundle`.
+BUNDLE_FILE = path.join(DB_DIR, "genetics.bin")
+BUNDLE_MAGIC = b"FGEN"
+BUNDLE_VERSION = 2
+# magic, format version, sha256 of the csv files, number of flower types
+BUNDLE_HEADER = struct.Struct("<4sH32sB")
+# Then for each flower type of `flower_files`: number of genes and number of rows, followed by
+# the gene letters (n_genes bytes), the row genotypes in csv order (n_rows uint16), and the color
+# index in `Flower.flowercolors` and seed / island flags of every genotype (2 x 3 ** n_genes bytes).
+BUNDLE_TYPE = struct.Struct("<BH")
+NO_COLOR = 0xFF
+SEED_FLAG = 1
+ISLAND_FLAG = 2
+
+
+def validate_flower_data(
+    file_type_couples: List[Tuple[str, FlowerType]]
+) -> Tuple[Dict[FlowerType, Tuple[GeneLayout, List[FlowerRow]]], List[str]]:
+    """
+    Gene layout and rows of every csv file, and notes. Raises ValueError listing every error:
+    malformed rows, and genotypes not covered exactly once. A file without any gene (violets)
+    only gives a note.
+    """
+    data: Dict[FlowerType, Tuple[GeneLayout, List[FlowerRow]]] = {}
+    errors: List[str] = []
+    notes: List[str] = []
 
     for file, flower_type in file_type_couples:
-        with open(path.join("data", file), "r") as fp:
-            for line in fp.readlines():
-                _, gene, *_, color_info = line.strip().split(",")
+        layout, rows, file_errors = parse_flower_csv(file, flower_type)
+        errors += file_errors
+        data[flower_type] = layout, rows
+
+        n_genes = len(layout)
+        with open(path.join(DATA_DIR, file), "r") as fp:
+            n_lines = sum(1 for line in fp if line.strip())
+        if not rows and not file_errors:
+            notes.append(f"{file}: no gene data, {flower_type} flowers are left out")
+            continue
+        if len(rows) + len(file_errors) != n_lines:
+            errors.append(f"{file}: {n_lines - len(rows) - len(file_errors)} row(s) without genes")
+
+        seen = Counter(genes for genes, _ in rows)
+        duplicates = [g for g, count in seen.items() if count > 1]
+        missing = [g for g in it.product(range(3), repeat=n_genes) if g not in seen]
+        if duplicates:
+            errors.append(f"{file}: genotypes listed more than once: {sorted(duplicates)}")
+        if missing:
+            errors.append(f"{file}: missing genotypes: {missing}")
+
+    if errors:
+        raise ValueError("Invalid flower data:\n" + "\n".join(errors))
+    return data, notes
+
+
+def genotype_index(genes: Sequence[int]) -> int:
+    """
+    Base-3 index of a gene sequence, as `flower.genotype.encode`.
+    """
+    return reduce(lambda acc, g: acc * 3 + g, genes, 0)
 
-                gene_code = read_code(gene)
 
-                c = FlowerColor(color_info.split()[0])
-                is_seed = (
-                    color_info.split()[1] == "(seed)"
-                    if len(color_info.split()) > 1
-                    else False
-                )
-                is_island = (
-                    color_info.split()[1] == "(island)"
-                    if len(color_info.split()) > 1
-                    else False
-                )
+def compile_flower_bundle(
+    file_type_couples: List[Tuple[str, FlowerType]] = flower_files
+) -> Tuple[bytes, List[str]]:
+    """
+    Validated csv files as a single binary bundle, and the validation notes.
+    """
+    data, notes = validate_flower_data(file_type_couples)
+
+    chunks = [BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, data_digest(), len(file_type_couples))]
+    for _, flower_type in file_type_couples:
+        layout, rows = data[flower_type]
+        n_genes = len(layout)
+        colors = bytearray([NO_COLOR]) * 3 ** n_genes
+        flags = bytearray(3 ** n_genes)
+        order = []
+        for genes, info in rows:
+            g = genotype_index(genes)
+            order.append(g)
+            colors[g] = Flower.flowercolors.index(info.color)
+            flags[g] = SEED_FLAG * info.seed | ISLAND_FLAG * info.island
+        chunks += [
+            BUNDLE_TYPE.pack(n_genes, len(rows)),
+            "".join(layout).encode("ascii"),
+            struct.pack(f"<{len(order)}H", *order),
+            bytes(colors),
+            bytes(flags),
+        ]
+    return b"".join(chunks), notes
 
-                # For violets
-                if gene_code:
-                    d[Flower(flower_type, tuple(gene_code))] = ColorSeedIsland(
-                        c, is_seed, is_island
-                    )
 
+def write_flower_bundle(file: str = BUNDLE_FILE) -> List[str]:
+    """
+    Compile and atomically write the bundle, returns the validation notes.
+    """
+    bundle, notes = compile_flower_bundle()
+    os.makedirs(path.dirname(file), exist_ok=True)
+    tmp = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as fp:
+        fp.write(bundle)
+    os.replace(tmp, file)
+    return notes
+
+
+def read_flower_bundle(
+    data: bytes, file_type_couples: List[Tuple[str, FlowerType]] = flower_files
+) -> Optional[FlowerDB]:
+    """
+    FlowerDB of a bundle, in csv order. None when the bundle was compiled from other csv files
+    or with another format.
+    """
+    if len(data) < BUNDLE_HEADER.size:
+        return None
+    magic, version, digest, n_types = BUNDLE_HEADER.unpack_from(data)
+    if (magic, version, digest, n_types) != (BUNDLE_MAGIC, BUNDLE_VERSION, data_digest(), len(file_type_couples)):
+        return None
+
+    # Few distinct (color, flags) pairs: share their ColorSeedIsland.
+    infos = {
+        (c, f): ColorSeedIsland(color, bool(f & SEED_FLAG), bool(f & ISLAND_FLAG))
+        for c, color in enumerate(Flower.flowercolors)
+        for f in range(4)
+    }
+    d = FlowerDB({})
+    offset = BUNDLE_HEADER.size
+    for _, flower_type in file_type_couples:
+        n_genes, n_rows = BUNDLE_TYPE.unpack_from(data, offset)
+        offset += BUNDLE_TYPE.size
+        size = 3 ** n_genes
+        layout = tuple(data[offset : offset + n_genes].decode("ascii"))
+        offset += n_genes
+        order = struct.unpack_from(f"<{n_rows}H", data, offset)
+        offset += 2 * n_rows
+        color = data[offset : offset + size]
+        flags = data[offset + size : offset + 2 * size]
+        offset += 2 * size
+
+        _gene_layouts[flower_type] = layout
+        # Base-3 digits of every genotype, most significant gene first.
+        all_genes = list(it.product(range(3), repeat=n_genes))
+        for g in order:
+            d[Flower(flower_type, all_genes[g])] = infos[color[g], flags[g]]
     return d
 
 
-flower_info = load_flower_info(
-    [
-        ("cosmos.csv", Flower.COSMOS),
-        ("hyacinths.csv", Flower.HYACINTHS),
-        ("lilies.csv", Flower.LILIES),
-        ("mums.csv", Flower.MUMS),
-        ("pansies.csv", Flower.PANSIES),
-        ("roses.csv", Flower.ROSES),
-        ("tulips.csv", Flower.TULIPS),
-        ("violets.csv", Flower.VIOLETS),
-        ("windflowers.csv", Flower.WINDFLOWERS),
-    ]
-)
+def load_flower_bundle(file: str = BUNDLE_FILE) -> Optional[FlowerDB]:
+    """
+    FlowerDB of the compiled bundle, None when it is missing or stale.
+    """
+    try:
+        with open(file, "rb") as fp:
+            data = fp.read()
+    except FileNotFoundError:
+        return None
+    return read_flower_bundle(data)
+
+
+_flower_info: Optional[FlowerDB] = None
+_flower_info_lock = threading.Lock()
+
+
+def get_flower_info() -> FlowerDB:
+    """
+    Flower data is only loaded on first access, once, even with concurrent callers:
+    from the compiled bundle, or parsed from the csv files when the bundle is missing or stale.
+    """
+    global _flower_info
+    if _flower_info is None:
+        with _flower_info_lock:
+            if _flower_info is None:
+                flower_info = load_flower_bundle()
+                if flower_info is None:
+                    flower_info = load_flower_info(flower_files)
+                _flower_info = flower_info
+    return _flower_info
+
+
+def __getattr__(name: str):
+    # Lazy module attribute: `main.flower_info` triggers loading.
+    if name == "flower_info":
+        return get_flower_info()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 @dataclass
@@ -284,6 +566,205 @@ class AncestorInfo:
 FlowerPedia = NewType("FlowerPedia", Dict[Flower, AncestorInfo],)
 
 
+@dataclass
+class SweepStats:
+    """
+    Counters of one sweep of `explore`: every known flower crossed with every new flower.
+    """
+    pairs: int = 0  # (f1, f2) pairs crossed
+    pruned: int = 0  # pairs skipped without being crossed
+    prob_test_hybrid_calls: int = 0
+    relaxations: int = 0  # offspring whose best probability improved
+    mix_cache_hits: int = 0
+    mix_cache_misses: int = 0
+    seconds: float = 0.0
+
+
+class ExploreStats:
+    """
+    Opt-in instrumentation of one `explore` run. Engines only count when given an instance.
+    """
+
+    counters = ("pairs", "pruned", "prob_test_hybrid_calls", "relaxations", "mix_cache_hits", "mix_cache_misses")
+
+    def __init__(self, engine: str = "reference"):
+        self.engine = engine
+        self.sweeps: List[SweepStats] = []
+        self._t0 = 0.0
+        self._mix_cache = mix_flowers.cache_info()
+
+    def start_sweep(self) -> SweepStats:
+        sweep = SweepStats()
+        self.sweeps.append(sweep)
+        self._mix_cache = mix_flowers.cache_info()
+        self._t0 = time.perf_counter()
+        return sweep
+
+    def end_sweep(self, sweep: SweepStats):
+        sweep.seconds = time.perf_counter() - self._t0
+        # Process wide lru_cache counters: concurrent calls from other threads are counted too.
+        mix_cache = mix_flowers.cache_info()
+        sweep.mix_cache_hits = mix_cache.hits - self._mix_cache.hits
+        sweep.mix_cache_misses = mix_cache.misses - self._mix_cache.misses
+
+    def totals(self) -> Dict[str, float]:
+        res: Dict[str, float] = {c: sum(getattr(s, c) for s in self.sweeps) for c in self.counters}
+        res["sweeps"] = len(self.sweeps)
+        res["seconds"] = sum(s.seconds for s in self.sweeps)
+        return res
+
+    def report(self) -> str:
+        header = ("sweep", "pairs", "pruned", "pruned %", "tests", "relaxed", "mix hit", "seconds")
+        totals = self.totals()
+        total = SweepStats(**{c: int(totals[c]) for c in self.counters}, seconds=totals["seconds"])
+        rows = [header]
+        for name, s in [(str(i + 1), s) for i, s in enumerate(self.sweeps)] + [("total", total)]:
+            lookups = s.mix_cache_hits + s.mix_cache_misses
+            rows.append(
+                (
+                    name,
+                    str(s.pairs),
+                    str(s.pruned),
+                    f"{s.pruned / (s.pairs + s.pruned):.1%}" if s.pairs + s.pruned else "-",
+                    str(s.prob_test_hybrid_calls),
+                    str(s.relaxations),
+                    f"{s.mix_cache_hits / lookups:.1%}" if lookups else "-",
+                    f"{s.seconds:.4f}",
+                )
+            )
+        widths = [max(len(r[c]) for r in rows) for c in range(len(header))]
+        return "\n".join("  ".join(v.rjust(w) for v, w in zip(r, widths)) for r in rows)
+
+
+class ExploreMetrics:
+    """
+    Process wide totals of instrumented `explore` runs, per engine.
+    Disabled unless the `FLOWER_INSTRUMENT` environment variable is set, or `enabled` is set.
+    """
+
+    def __init__(self):
+        self.enabled = bool(os.environ.get("FLOWER_INSTRUMENT"))
+        self.runs: Counter = Counter()
+        self.totals: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+
+    def stats(self, engine: str, stats: Optional[ExploreStats]) -> Optional[ExploreStats]:
+        """
+        `stats` given to an engine, or a fresh one to be recorded when the metrics are enabled.
+        """
+        if stats is None and self.enabled:
+            return ExploreStats(engine)
+        return stats
+
+    def record(self, stats: Optional[ExploreStats]):
+        if stats is None or not self.enabled:
+            return
+        with self._lock:
+            self.runs[stats.engine] += 1
+            self.totals.setdefault(stats.engine, Counter()).update(stats.totals())
+
+    def prometheus(self) -> str:
+        """
+        Counters in Prometheus text exposition format.
+        """
+        with self._lock:
+            runs = dict(self.runs)
+            totals = {engine: dict(c) for engine, c in self.totals.items()}
+        lines = ["# TYPE flower_explore_runs counter"]
+        lines += [f'flower_explore_runs{{engine="{engine}"}} {n}' for engine, n in sorted(runs.items())]
+        for metric in ExploreStats.counters + ("sweeps", "seconds"):
+            lines.append(f"# TYPE flower_explore_{metric} counter")
+            for engine, c in sorted(totals.items()):
+                lines.append(f'flower_explore_{metric}{{engine="{engine}"}} {c.get(metric, 0)}')
+        return "\n".join(lines) + "\n"
+
+
+explore_metrics = ExploreMetrics()
+
+
+class FlowerIndex:
+    """
+    Inverted indexes of a FlowerDB on type, color, seed and island.
+    Conjunctive queries are answered by set intersection and memoized as immutable tuples,
+    in the FlowerDB order.
+    """
+
+    attributes = ("type", "color", "is_seed", "is_island")
+
+    def __init__(self, flower_info: FlowerDB):
+        self._order = {f: n for n, f in enumerate(flower_info)}
+        self._all = frozenset(flower_info)
+
+        index: Dict[str, Dict[Any, Set[Flower]]] = {attr: {} for attr in self.attributes}
+        for f, info in flower_info.items():
+            values = (f.type, FlowerColor(info.color), bool(info.seed), bool(info.island))
+            for attr, value in zip(self.attributes, values):
+                index[attr].setdefault(value, set()).add(f)
+
+        self._index = {
+            attr: {value: frozenset(flowers) for value, flowers in d.items()}
+            for attr, d in index.items()
+        }
+        self._queries: Dict[Tuple, Tuple[Flower, ...]] = {}
+        self._distinct: Dict[Tuple, Tuple[Any, ...]] = {}
+
+    @staticmethod
+    def _criterion(val) -> Optional[Tuple]:
+        # Same semantics as `universal_get`: None matches everything, a sequence matches any of its values.
+        if val is None:
+            return None
+        if isinstance(val, str) or not isinstance(val, Sequence):
+            return (val,)
+        return tuple(val)
+
+    def query(
+        self,
+        _type: Optional[FlowerType] = None,
+        _color: Optional[FlowerColor] = None,
+        _seed: Optional[bool] = None,
+        _island: Optional[bool] = None,
+    ) -> Tuple[Flower, ...]:
+        key = tuple(self._criterion(v) for v in (_type, _color, _seed, _island))
+
+        res = self._queries.get(key)
+        if res is None:
+            candidates = self._all
+            for attr, values in zip(self.attributes, key):
+                if values is None:
+                    continue
+                index = self._index[attr]
+                candidates = candidates & frozenset().union(*(index.get(v, ()) for v in values))
+
+            res = tuple(sorted(candidates, key=self._order.__getitem__))
+            self._queries[key] = res
+        return res
+
+    def distinct(self, attr: str, **criteria) -> Tuple[Any, ...]:
+        """
+        Sorted distinct values of `attr` among the flowers matching `criteria`.
+        """
+        key = (attr, *(self._criterion(criteria.get(f"_{a}")) for a in ("type", "color", "seed", "island")))
+
+        res = self._distinct.get(key)
+        if res is None:
+            res = tuple(sorted({getattr(f, attr) for f in self.query(**criteria)}))
+            self._distinct[key] = res
+        return res
+
+
+_flower_index: Optional[FlowerIndex] = None
+_flower_index_lock = threading.Lock()
+
+
+def get_flower_index() -> FlowerIndex:
+    global _flower_index
+    if _flower_index is None:
+        with _flower_index_lock:
+            if _flower_index is None:
+                _flower_index = FlowerIndex(get_flower_info())
+    return _flower_index
+
+
 def universal_get(
     flower_info: FlowerDB,
     _type: Optional[FlowerType] = None,
@@ -291,33 +772,11 @@ def universal_get(
     _seed: Optional[bool] = None,
     _island: Optional[bool] = None,
 ) -> List[Flower]:
-
-    res = []
-
-    def test_cond(val, attr):
-        def test(x, val=val, attr=attr):
-            if val is None:
-                return True
-            if not isinstance(val, Sequence):
-                val = [val]
-
-            if getattr(x, attr) in val:
-                return True
-            return False
-
-        return test
-
-    tests_AND = [
-        test_cond(_type, "type"),
-        test_cond(_color, "color"),
-        test_cond(_seed, "is_seed"),
-        test_cond(_island, "is_island"),
-    ]
-
-    for flower in flower_info:
-        if all(test(flower) for test in tests_AND):
-            res.append(flower)
-    return res
+    """
+    All flowers of `flower_info` matching every given criterion.
+    """
+    index = get_flower_index() if flower_info is get_flower_info() else FlowerIndex(flower_info)
+    return list(index.query(_type, _color, _seed, _island))
 
 
 uget = universal_get
@@ -347,7 +806,8 @@ def prob_test_hybrid(
     best_color = None
 
     # Try to hybrid new flower with old (known_flowers).
-    for other_f in known_flowers:
+    # Sorted iteration keeps tie-breaking independent from hash randomization.
+    for other_f in sorted(known_flowers):
         h_colors = {f.color for f, p in f_h + other_f}
 
         concurrent_colors = {
@@ -362,7 +822,7 @@ def prob_test_hybrid(
 
         if len(possible_test_colors) > 0:
             # There is some color that we can use.
-            for test_color in possible_test_colors:
+            for test_color in sort_colors(possible_test_colors):
                 p_color = sum(p for f, p in f_h + other_f if f.color == test_color)
 
                 if p_color > best_p_color:
@@ -376,11 +836,11 @@ def prob_test_hybrid(
         concurrent_colors = {f.color for f, p in other_f + other_f}
 
         possible_test_colors = (
-            h_colors - concurrent_colors - {f_h.color,}
+            f_h_colors - concurrent_colors - {f_h.color,}
         )
 
         if len(possible_test_colors) > 0:
-            for test_color in possible_test_colors:
+            for test_color in sort_colors(possible_test_colors):
                 p_color = sum(p for f, p in f_h + f_h if f.color == test_color)
 
                 if p_color > best_p_color:
@@ -401,10 +861,14 @@ o(f OK & f test)    = o(f color ok) * o(f ok | f color OK) * o(f_test color | f
 """
 
 
-def explore(base_flowers: List[Flower]) -> FlowerPedia:
+def explore(base_flowers: List[Flower], stats: Optional[ExploreStats] = None) -> FlowerPedia:
     """
     Compute best path to obtain each flower using only `base_flowers`
+    Per sweep counters are collected into `stats` when given.
     """
+    stats = explore_metrics.stats("reference", stats)
+    sweep = None
+
     flowerpedia = FlowerPedia(
         {
             f: AncestorInfo(
@@ -431,13 +895,19 @@ def explore(base_flowers: List[Flower]) -> FlowerPedia:
     while modified:
         i += 1
         modified = False
+        if stats is not None:
+            sweep = stats.start_sweep()
 
+        # Sorted once per sweep: new flowers of this sweep go to `next_new_flowers`.
+        new_sorted = sorted(new_flowers)
         for f1 in flowerpedia.copy():  # Iterate over all flowers seen so far
             dp_f1 = flowerpedia[f1]
-            for f2 in new_flowers:
+            for f2 in new_sorted:
                 if f1 in new_flowers and f1 > f2:
                     continue
                 dp_f2 = flowerpedia[f2]
+                if sweep is not None:
+                    sweep.pairs += 1
 
                 # Compute unique flowers needed to produce f1 and f2
                 pred_common = dp_f1.ancestors & dp_f2.ancestors
@@ -448,7 +918,7 @@ def explore(base_flowers: List[Flower]) -> FlowerPedia:
                         mul,
                         (
                             flowerpedia[fi].micro_prob * flowerpedia[fi].test.test_prob
-                            for fi in pred_common
+                            for fi in sorted(pred_common)
                         ),
                         1.0,
                     )  # All flower in pred_common are counter twice in `prob_f1 * prob_f2`
@@ -464,6 +934,8 @@ def explore(base_flowers: List[Flower]) -> FlowerPedia:
                     h_ancestors = dp_f1.ancestors | dp_f2.ancestors | {f1, f2}
 
                     test_result = prob_test_hybrid(f1, f2, f, h_ancestors)
+                    if sweep is not None:
+                        sweep.prob_test_hybrid_calls += 1
 
                     prob_f = prob_common * p * test_result.test_prob
                     if prob_f > 0:
@@ -478,10 +950,16 @@ def explore(base_flowers: List[Flower]) -> FlowerPedia:
                             )
                             modified = True
                             next_new_flowers.add(f)
+                            if sweep is not None:
+                                sweep.relaxations += 1
 
         # All flowers will be mixed with all updates flowers during next iteration of algorithm.
         new_flowers = next_new_flowers
         next_new_flowers = set()
+        if sweep is not None:
+            stats.end_sweep(sweep)
+
+    explore_metrics.record(stats)
     return flowerpedia
 
 
@@ -530,9 +1008,130 @@ def ancestors(
         }
 
 
-def stepify(tgt_flower: Flower, ancestor_tree: Dict[str, Any]) -> Tuple[List[Any], Dict[Flower, str]]:
+TEST_KEYS = "unknown_flower_code unknown_flower_color test_flower_code test_flower_color test_prob test_color".split()
+
+
+class Plan(NamedTuple):
+    target: Flower
+    graph: Dict[str, Any]  # `plan_graph` format
+    steps: List[Tuple[Flower, Tuple[Flower, ...], Any, Optional[Dict[str, Any]]]]  # `stepify` format
+    names: Dict[str, str]  # flower code -> given name
+    base_flowers: List[Flower]  # needed in the steps or in the tests
+    tests: List[List[Any]]  # `TEST_KEYS` values of each test
+
+
+def build_plan(tgt: Flower, flowerpedia: FlowerPedia, memo: Optional[Dict[Flower, Dict[str, Any]]] = None) -> Plan:
+    """
+    Best way to obtain Flower `tgt` given a `flowerpedia`, in a single iterative walk of the parents.
+    Gives the same graph as `plan_graph` and the same steps and names as `stepify`.
+    `memo` shares the nodes of common ancestors between the plans of several targets of the same
+    `flowerpedia`: each flower is described once. Nodes must not be modified.
+    """
+    nodes: List[Dict[str, Any]] = []
+    edges: List[List[int]] = []
+    index: Dict[Flower, int] = {}
+
+    steps: List[Any] = []
+    names: Dict[str, str] = {}
+    n_colors: Counter = Counter()
+    base_flowers: List[Flower] = []
+    test_flowers: List[Flower] = []
+    tests: List[List[Any]] = []
+
+    def name(code: str, color: FlowerColor):
+        names[code] = f"{color}_{n_colors[color]}"
+        n_colors[color] += 1
+
+    # Postfix order: a flower is emitted once both its parents are, first parent first.
+    stack: List[Tuple[Flower, bool]] = [(tgt, False)]
+    while stack:
+        f, parents_done = stack.pop()
+        if f in index:
+            continue
+        info = flowerpedia[f]
+
+        if info.parents is not None and not parents_done:
+            p1, p2 = info.parents
+            stack.append((f, True))
+            stack.append((p2, False))
+            stack.append((p1, False))
+            continue
+
+        if info.parents is None:
+            parents: Tuple[Flower, ...] = ()
+        else:
+            p1, p2 = info.parents
+            parents = (p1,) if p1 == p2 else (p1, p2)
+
+        node = memo.get(f) if memo is not None else None
+        if node is not None:
+            code, color = node["code"], node["color"]
+        elif info.parents is None:
+            code, color = f.code, f.color
+            node = {"code": code, "color": color}
+        else:
+            code, color = f.code, f.color
+            test = info.test
+            node = {
+                "code": code,
+                "color": color,
+                "prob": f"{info.micro_prob:.03}",
+                "total_prob": f"{info.total_prob:.03}",
+                "test": {
+                    "unknown_flower_code": test.unknown_flower.code,
+                    "unknown_flower_color": test.unknown_flower.color,
+                    "test_flower_code": test.test_flower.code,
+                    "test_flower_color": test.test_flower.color,
+                    "test_prob": test.test_prob,
+                    "test_color": test.test_color,
+                } if test.test_flower and test.unknown_flower else None,
+            }
+        if memo is not None:
+            memo[f] = node
+
+        index[f] = len(nodes)
+        nodes.append(node)
+        edges.extend([index[p], index[f]] for p in parents)
+
+        # Flowers may already be named as test flowers, they then get no step.
+        if code not in names:
+            name(code, color)
+            t = node.get("test")
+            if t is not None:
+                if t["test_flower_code"] not in names:
+                    name(t["test_flower_code"], t["test_flower_color"])
+                test_flowers.append(info.test.test_flower)
+                tests.append([t[k] for k in TEST_KEYS])
+            steps.append((f, parents, node.get("prob", 1.), t))
+            if not parents:
+                base_flowers.append(f)
+
+    # Test flowers which are neither base flowers nor obtained in a step are needed too.
+    hybrids = {f for f, parents, *_ in steps if parents}
+    for f in test_flowers:
+        if f not in hybrids and f not in base_flowers:
+            base_flowers.append(f)
+
+    return Plan(tgt, {"nodes": nodes, "edges": edges}, steps, names, base_flowers, tests)
+
+
+def plan_graph(tgt: Flower, flowerpedia: FlowerPedia) -> Dict[str, Any]:
+    """
+    Determines best way to obtain Flower `tgt` given a `flowerpedia`, as a DAG.
+    Unlike `ancestors`, a flower needed several times appears once:
+
+        {"nodes": [{"code", "color", "prob", "total_prob", "test"}, ...],
+         "edges": [[parent node index, child node index], ...]}
+
+    Nodes are listed parents first, `tgt` is the last one. Base flowers only have "code" and "color",
+    a flower crossed with itself has a single edge.
     """
-    Gives an ordered list of steps to obtain root flower of the ancestor tree.
+    return build_plan(tgt, flowerpedia).graph
+
+
+def stepify(tgt_flower: Flower, plan: Dict[str, Any]) -> Tuple[List[Any], Dict[Flower, str]]:
+    """
+    Gives an ordered list of steps to obtain the target of a `plan_graph`.
     each step is: 
 
         If this is the first time we make this flower:
@@ -546,59 +1145,72 @@ def stepify(tgt_flower: Flower, ancestor_tree: Dict[str, Any]) -> Tuple[List[Any
     res: List[Any] = []
     names: Dict[Flower, str] = {}
 
-    def helper_postfix(tree: dict, names_ref: Dict[Flower, str], res_ref: List[Any]):
-        curr_gene = read_code(tree["code"])
-        curr_f = Flower(tgt_flower.type, curr_gene)
-        
-        # Downstream
-        children = [tree[v] for v in ["A", "B"] if v in tree and tree[v]]
-
-        for child in children:
-            helper_postfix(child, names_ref, res_ref)
-
-        # Upstream
-        
-        # This is a new flower
-        if tree["code"] not in names_ref:
-            n_color = sum(1 for v in names_ref.values() if v.startswith(tree["color"]))
-            names_ref[tree["code"]] = f"{tree['color']}_{n_color}"
+    nodes = plan["nodes"]
+    flowers = [Flower(tgt_flower.type, read_code(node["code"])) for node in nodes]
+    parents: List[List[int]] = [[] for _ in nodes]
+    for a, b in plan["edges"]:
+        parents[b].append(a)
+
+    # Nodes are in the postfix order of the ancestors tree.
+    for i, node in enumerate(nodes):
+        # This is a new flower (flowers may already be named as test flowers)
+        if node["code"] not in names:
+            n_color = sum(1 for v in names.values() if v.startswith(node["color"]))
+            names[node["code"]] = f"{node['color']}_{n_color}"
             
-            if "test" in tree and tree["test"] and tree["test"]["test_flower_code"] not in names_ref:
-                n_color = sum(1 for v in names_ref.values() if v.startswith(tree["test"]["test_flower_color"]))
-                names_ref[tree["test"]["test_flower_code"]] = f"{tree['test']['test_flower_color']}_{n_color}"
+            test = node.get("test")
+            if test and test["test_flower_code"] not in names:
+                n_color = sum(1 for v in names.values() if v.startswith(test["test_flower_color"]))
+                names[test["test_flower_code"]] = f"{test['test_flower_color']}_{n_color}"
             
-            
-            res_ref.append((curr_f,
-                            tuple(Flower(tgt_flower.type, read_code(c["code"])) for c in children),
-                            tree["prob"] if "prob" in tree else 1.,
-                            tree["test"] if "test" in tree else None))
-        
-    helper_postfix(ancestor_tree, names, res)
+            res.append((flowers[i], tuple(flowers[p] for p in parents[i]), node.get("prob", 1.), test))
+
     return res, names
 
 
+PartitionKey = Tuple[FlowerType, bool, bool]
+
+
+def db_partition_keys() -> List[PartitionKey]:
+    """
+    Every (type, seed, island) partition of the FlowerPedia DB.
+    """
+    return [
+        (t, s, i)
+        for t in Flower.flowertypes
+        for s in [True, False]
+        for i in [True, False]
+        if s or i
+    ]
+
+
+def partition_base_flowers(key: PartitionKey) -> List[Flower]:
+    t, s, i = key
+
+    base_flowers = []
+    if s:
+        base_flowers += uget(get_flower_info(), _type=t, _seed=s, _island=False)
+    if i:
+        base_flowers += uget(get_flower_info(), _type=t, _seed=False, _island=i)
+    return base_flowers
+
+
+def db_partitions() -> Iterator[Tuple[PartitionKey, List[Flower]]]:
+    """
+    Every partition of the FlowerPedia DB with its base flowers.
+    """
+    for key in db_partition_keys():
+        yield key, partition_base_flowers(key)
+
+
 def get_flowerpedia_db():
-    if path.isfile("db/flowerpedia_db.pkl"):
-        db = pickle.load(open("db/flowerpedia_db.pkl", "rb"))
-        return db
-
-    db = {}
-    for t in Flower.flowertypes:
-        print(t)
-        for s in [True, False]:
-            for i in [True, False]:
-                if not s and not i:
-                    continue
-                
-                base_flowers = []
-                if s:
-                    base_flowers += uget(flower_info, _type=t, _seed=s, _island=False)
-                if i:
-                    base_flowers += uget(flower_info, _type=t, _seed=False, _island=i)
-                    
-                
-                db[(t, s, i)] = explore(base_flowers)
-    return db
+    """
+    FlowerPedia of every partition, from the versioned store in `DB_DIR`: the shared memory-mapped
+    layout when it is up to date (unless `FLOWER_DB_MAPPED=0`), else partitions loaded on demand.
+    """
+    from flower import store
+
+    return store.open_db(DB_DIR, mapped=os.environ.get("FLOWER_DB_MAPPED", "1") != "0")
 
 
 def cli():
@@ -643,6 +1255,11 @@ def cli():
         help="Include tests during the search",
         default=False,
     )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print explore counters and timings per sweep",
+    )
 
     args = parser.parse_args()
 
@@ -652,29 +1269,29 @@ def cli():
         tgt_flowers = [Flower(args.type, args.code)]
     else:
         tgt_flowers = uget(
-            flower_info, _type=args.type, _color=args.color, _seed=None, _island=None
+            get_flower_info(), _type=args.type, _color=args.color, _seed=None, _island=None
         )
 
     base_flowers = []
     if args.seed:
         base_flowers += uget(
-            flower_info, _type=args.type, _color=None, _seed=args.seed, _island=None
+            get_flower_info(), _type=args.type, _color=None, _seed=args.seed, _island=None
         )
     if args.island:
         base_flowers += uget(
-            flower_info, _type=args.type, _color=None, _seed=None, _island=args.island
+            get_flower_info(), _type=args.type, _color=None, _seed=None, _island=args.island
         )
 
     # print(f"{args=}")
     # print(f"{tgt_flowers=}")
-    return base_flowers, tgt_flowers
+    return base_flowers, tgt_flowers, args
 
 
 def main():
     # import cProfile
 
     # cProfile.run(
-    #     "explore(uget(flower_info, _type=Flower.ROSES, _color=None, _seed=True, _island=False))"
+    #     "explore(uget(get_flower_info(), _type=Flower.ROSES, _color=None, _seed=True, _island=False))"
     # )
 
     # --- 
@@ -684,24 +1301,23 @@ def main():
 
     # ---
 
-    base, tgt = cli()
-    flowerpedia = explore(base)
+    base, tgt, args = cli()
+    stats = ExploreStats() if args.profile else None
+    flowerpedia = explore(base, stats)
+    if stats is not None:
+        print(stats.report())
     
     for t in tgt:
         print(t, t in flowerpedia)
     
     max_tgt = max(tgt, key=lambda x: flowerpedia[x].total_prob if x in flowerpedia else -math.inf)
-    pprint(a := ancestors(max_tgt, flowerpedia))
+    pprint(a := plan_graph(max_tgt, flowerpedia))
     pprint(stepify(max_tgt, a))
 
     # ---
     
     # db = get_flowerpedia_db()
-    
-    # with open("flowerpedia_db.pkl", "wb") as f:
-    #     pickle.dump(db, f)
-        
-    # print(db)
+    # print(db[(Flower.ROSES, True, False)])
 
 if __name__ == "__main__":
     
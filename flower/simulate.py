@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+"""
+File:   simulate.py
+
+Monte Carlo simulation of breeding plans with NumPy.
+
+Every hybrid step of a plan is repeated until it gives its flower. An attempt is a cross, followed
+by a test cross when the flower can only be told apart from its look-alikes with a test: it succeeds
+with probability `micro_prob * test_prob`, the per step factors of `AncestorInfo.total_prob`.
+A failed test throws the candidate away, the step starts over.
+
+`attempts` is the total number of attempts of a plan. Steps whose parents are ready can be done
+in parallel: `rounds` is the number of attempts along the critical path, i.e. the number of days
+when each pair of parents is crossed once a day.
+
+Trials are run by chunks of `BATCH` with one seed per chunk spawned from the user seed, so that
+results only depend on the seed and on the number of trials, not on the number of processes.
+"""
+
+import math
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import *
+
+import numpy as np
+
+from flower.main import Flower, FlowerPedia, Plan
+
+BATCH = 2 ** 18
+PERCENTILES = (50, 90, 99)
+
+
+class PlanModel(NamedTuple):
+    target: Flower
+    steps: List[Flower]  # Hybrid steps, parents first.
+    parents: List[Tuple[int, ...]]  # Indices of the hybrid parents of each step.
+    success_prob: List[float]  # Probability that one attempt of a step succeeds.
+
+
+def plan_model(plan: Plan, flowerpedia: FlowerPedia) -> PlanModel:
+    """
+    Hybrid steps of `plan`, with the exact probabilities of the FlowerPedia rather than the rounded
+    ones of the plan.
+    """
+    steps: List[Flower] = []
+    parents: List[Tuple[int, ...]] = []
+    success_prob: List[float] = []
+    index: Dict[Flower, int] = {}
+
+    for f, f_parents, *_ in plan.steps:
+        if not f_parents:
+            continue
+        info = flowerpedia[f]
+        index[f] = len(steps)
+        steps.append(f)
+        # Base flowers (and flowers made earlier for a test) are ready from the start.
+        parents.append(tuple(index[p] for p in set(f_parents) if p in index))
+        success_prob.append(info.micro_prob * info.test.test_prob)
+
+    return PlanModel(plan.target, steps, parents, success_prob)
+
+
+class Histograms(NamedTuple):
+    """
+    Attempt counts: `h[v]` trials needed `v` attempts.
+    """
+
+    trials: int
+    steps: List[np.ndarray]
+    attempts: np.ndarray
+    rounds: np.ndarray
+
+
+def merge(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    if len(a) < len(b):
+        a, b = b, a
+    res = a.copy()
+    res[: len(b)] += b
+    return res
+
+
+def simulate_chunk(model: PlanModel, trials: int, seed: np.random.SeedSequence) -> Histograms:
+    rng = np.random.default_rng(seed)
+
+    attempts = np.zeros(trials, dtype=np.int64)
+    finish: List[np.ndarray] = []
+    steps = []
+    for parents, p in zip(model.parents, model.success_prob):
+        step = rng.geometric(p, size=trials)
+        steps.append(np.bincount(step))
+        attempts += step
+
+        ready = np.zeros(trials, dtype=np.int64)
+        for i in parents:
+            np.maximum(ready, finish[i], out=ready)
+        finish.append(ready + step)
+
+    rounds = finish[-1] if finish else np.zeros(trials, dtype=np.int64)
+    return Histograms(trials, steps, np.bincount(attempts), np.bincount(rounds))
+
+
+def _simulate_chunk(args) -> Histograms:
+    return simulate_chunk(*args)
+
+
+def simulate(model: PlanModel, trials: int, seed: Optional[int] = None, workers: int = 1) -> Histograms:
+    """
+    Run `trials` simulations of `model`, over a process pool when `workers` > 1.
+    """
+    chunks = [min(BATCH, trials - start) for start in range(0, trials, BATCH)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    jobs = [(model, size, s) for size, s in zip(chunks, seeds)]
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_simulate_chunk, jobs))
+    else:
+        results = [simulate_chunk(*job) for job in jobs]
+
+    res = Histograms(0, [np.zeros(1, dtype=np.int64) for _ in model.steps], np.zeros(1, np.int64), np.zeros(1, np.int64))
+    for h in results:
+        res = Histograms(
+            res.trials + h.trials,
+            [merge(a, b) for a, b in zip(res.steps, h.steps)],
+            merge(res.attempts, h.attempts),
+            merge(res.rounds, h.rounds),
+        )
+    return res
+
+
+def distribution(hist: np.ndarray, percentiles: Sequence[float]) -> Dict[str, Any]:
+    """
+    Mean and percentiles (smallest value reached by at least that share of the trials).
+    """
+    n = hist.sum()
+    cdf = np.cumsum(hist)
+    return {
+        "mean": float(np.dot(np.arange(len(hist)), hist) / n) if n else 0.0,
+        "percentiles": {
+            f"p{q:g}": int(np.searchsorted(cdf, math.ceil(n * q / 100 - 1e-9))) if n else 0 for q in percentiles
+        },
+    }
+
+
+def summary(model: PlanModel, hist: Histograms, percentiles: Sequence[float] = PERCENTILES) -> Dict[str, Any]:
+    return {
+        "target": model.target.code,
+        "trials": hist.trials,
+        "steps": [
+            {"code": f.code, "color": f.color, "success_prob": p, "attempts": distribution(h, percentiles)}
+            for f, p, h in zip(model.steps, model.success_prob, hist.steps)
+        ],
+        "attempts": distribution(hist.attempts, percentiles),
+        "rounds": distribution(hist.rounds, percentiles),
+    }
+
+
+def report(summ: Dict[str, Any]) -> str:
+    """
+    Human readable table of a `summary`.
+    """
+    names = list(summ["attempts"]["percentiles"])
+    header = ("step", "color", "p(success)", "mean") + tuple(names)
+    rows = [header]
+
+    def row(name, color, p, dist):
+        return (name, color, p, f"{dist['mean']:.1f}") + tuple(str(dist["percentiles"][k]) for k in names)
+
+    for s in summ["steps"]:
+        rows.append(row(s["code"], s["color"], f"{s['success_prob']:.4g}", s["attempts"]))
+    rows.append(row("attempts", "", "", summ["attempts"]))
+    rows.append(row("rounds", "", "", summ["rounds"]))
+
+    widths = [max(len(r[c]) for r in rows) for c in range(len(header))]
+    lines = ["  ".join(v.rjust(w) for v, w in zip(r, widths)) for r in rows]
+    return f"{summ['trials']} trials of {summ['target']}\n" + "\n".join(lines)
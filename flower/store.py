@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+
+"""
+File:   store.py
+
+Versioned on-disk FlowerPedia store.
+
+Each (type, seed, island) partition lives in its own small binary file:
+
+    header:  magic, format version, algorithm version, sha256 of the data csv files,
+             number of genes, number of entries
+    entries: one fixed size record per genotype, in discovery order (see `record_struct`)
+
+A partition is read on first access only. A file written from other csv files or by another
+algorithm version is stale: it keeps being served while a background thread rebuilds it.
+
+`flowerpedia.map` holds every partition in a single read-only file, memory-mapped and queried
+in place: processes mapping it share one physical copy through the page cache.
+
+    header:    magic, format version, algorithm version, sha256 of the data csv files,
+               number of partitions
+    directory: (type, seed, island, number of entries, offset) of each partition
+    partition: genotypes in discovery order, row of every genotype (`Species.none` when unknown),
+               both with the `Species.typecode` of the pedia arrays, then the records of the
+               partition files, in discovery order
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from os import path
+from typing import *
+
+from flower import genotype
+from flower.genotype import Entry, FlowerPediaView, IndexedPedia, IndexedTest, Species
+from flower.main import (
+    AncestorInfo,
+    Flower,
+    PartitionKey,
+    data_digest,
+    db_partition_keys,
+    db_partitions,
+    partition_base_flowers,
+)
+
+# Bump whenever `explore` may produce a different FlowerPedia.
+ALGORITHM_VERSION = 2
+FORMAT_VERSION = 2
+
+MAGIC = b"FPDB"
+HEADER = struct.Struct("<4sHH32sBH")
+
+MAP_FILE = "flowerpedia.map"
+MAP_MAGIC = b"FPDM"
+MAP_HEADER = struct.Struct("<4sHH32sB")
+# index in `Flower.flowertypes`, seed, island, number of entries, offset of the partition
+MAP_DIRECTORY = struct.Struct("<BBBHI")
+
+
+def bitset_size(sp: Species) -> int:
+    """
+    Bytes of an ancestors bitset, one bit per genotype of the species.
+    """
+    return (sp.size + 7) // 8
+
+
+@lru_cache(maxsize=None)
+def record_struct(sp: Species) -> struct.Struct:
+    """
+    Record of a genotype: genotype, parent A, parent B, micro prob, no test global prob,
+    unknown flower, test flower, test color, test prob, ancestors bitset (little endian).
+    Genotypes and colors have the `typecode` of the pedia arrays of the species.
+    """
+    code = sp.typecode
+    return struct.Struct(f"<{code}{code}{code}dd{code}{code}{code}d{bitset_size(sp)}s")
+
+
+def source_hash() -> bytes:
+    """
+    Hash of every csv the FlowerPedia is computed from.
+    """
+    return data_digest()
+
+
+def partition_file(db_dir: str, key: PartitionKey) -> str:
+    flower_type, seed, island = key
+    return path.join(db_dir, f"{flower_type.strip('_').lower()}_{int(seed)}{int(island)}.fpd")
+
+
+def encode_partition(flowerpedia: IndexedPedia, digest: bytes) -> bytes:
+    p = flowerpedia
+    record, n_bytes = record_struct(p.species), bitset_size(p.species)
+    chunks = [HEADER.pack(MAGIC, FORMAT_VERSION, ALGORITHM_VERSION, digest, p.species.n_genes, len(p))]
+    for f in p.order:
+        chunks.append(
+            record.pack(
+                f,
+                p.parent_a[f],
+                p.parent_b[f],
+                p.micro[f],
+                p.no_test[f],
+                p.test_unknown[f],
+                p.test_tester[f],
+                p.test_color[f],
+                p.test_prob[f],
+                p.ancestors[f].to_bytes(n_bytes, "little"),
+            )
+        )
+    return b"".join(chunks)
+
+
+def decode_record(sp: Species, record: Tuple) -> Tuple[int, Entry]:
+    f, pa, pb, micro, no_test, unknown, tester, color, test_prob, ancestors = record
+    none = sp.none
+    test = IndexedTest(
+        None if unknown == none else unknown,
+        None if tester == none else tester,
+        test_prob,
+        None if color == none else color,
+    )
+    return f, Entry(
+        None if pa == none else (pa, pb),
+        int.from_bytes(ancestors, "little"),
+        test,
+        micro,
+        no_test,
+        test_prob * no_test,
+    )
+
+
+def decode_partition(data: bytes, flower_type) -> Tuple[IndexedPedia, bool]:
+    """
+    Returns the partition and whether it is up to date.
+    """
+    magic, fmt, algorithm, digest, n_genes, n_entries = HEADER.unpack_from(data)
+    if magic != MAGIC or fmt != FORMAT_VERSION:
+        raise ValueError(f"Unsupported FlowerPedia file format ({magic!r}, version {fmt}).")
+
+    sp = genotype.species(flower_type)
+    assert n_genes == sp.n_genes, f"Expected {sp.n_genes} genes for {flower_type}, got {n_genes}."
+
+    record = record_struct(sp)
+    flowerpedia = IndexedPedia(sp)
+    for values in record.iter_unpack(data[HEADER.size : HEADER.size + n_entries * record.size]):
+        f, entry = decode_record(sp, values)
+        flowerpedia.set(f, *entry[:5])
+
+    up_to_date = algorithm == ALGORITHM_VERSION and digest == source_hash()
+    return flowerpedia, up_to_date
+
+
+def build_partition(key: PartitionKey, base_flowers: List[Flower]) -> IndexedPedia:
+    """
+    Branch and bound exploration, the FlowerPedia of `explore_indices` with fewer crosses.
+    """
+    sp = genotype.species(key[0])
+    return genotype.explore_bounded(sp, [sp.index(f) for f in base_flowers])
+
+
+def write_partition(db_dir: str, key: PartitionKey, flowerpedia: IndexedPedia, digest: bytes):
+    """
+    Atomic write: readers never see a partially written partition.
+    """
+    file = partition_file(db_dir, key)
+    tmp = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as fp:
+        fp.write(encode_partition(flowerpedia, digest))
+    os.replace(tmp, file)
+
+
+def is_up_to_date(db_dir: str, key: PartitionKey) -> bool:
+    file = partition_file(db_dir, key)
+    if not path.isfile(file):
+        return False
+    with open(file, "rb") as fp:
+        _, fmt, algorithm, digest, *_ = HEADER.unpack(fp.read(HEADER.size))
+    return fmt == FORMAT_VERSION and algorithm == ALGORITHM_VERSION and digest == source_hash()
+
+
+def _build_job(db_dir: str, key: PartitionKey, base_flowers: List[Flower]) -> Tuple[PartitionKey, float, int]:
+    """
+    Process pool job: compute a partition and write it right away.
+    """
+    t0 = time.perf_counter()
+    flowerpedia = build_partition(key, base_flowers)
+    write_partition(db_dir, key, flowerpedia, source_hash())
+    return key, time.perf_counter() - t0, len(flowerpedia)
+
+
+def build_db(
+    db_dir: str,
+    workers: Optional[int] = None,
+    keys: Optional[Iterable[PartitionKey]] = None,
+    stale_only: bool = False,
+) -> Dict[PartitionKey, float]:
+    """
+    Compute partitions (all of them by default) over a pool of `workers` processes.
+    Every partition is written to disk as soon as it is done, so an interrupted build
+    keeps its finished partitions. Returns the build time of each partition.
+    """
+    os.makedirs(db_dir, exist_ok=True)
+    selected = set(keys) if keys is not None else None
+    jobs = [
+        (key, base_flowers)
+        for key, base_flowers in db_partitions()
+        if (selected is None or key in selected) and not (stale_only and is_up_to_date(db_dir, key))
+    ]
+
+    timings = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_build_job, db_dir, key, base_flowers) for key, base_flowers in jobs]
+        for future in as_completed(futures):
+            key, seconds, n_flowers = future.result()
+            timings[key] = seconds
+            print(f"{partition_file(db_dir, key)}: {n_flowers} flowers in {seconds:.3f}s", flush=True)
+    return timings
+
+
+class FlowerPediaDB(Mapping[PartitionKey, Mapping[Flower, AncestorInfo]]):
+    """
+    {(type, seed, island): FlowerPedia view}, each partition is loaded on first access.
+    Missing partitions are computed synchronously, stale ones are regenerated in background.
+    """
+
+    def __init__(self, db_dir: str):
+        self.db_dir = db_dir
+        self._keys: List[PartitionKey] = db_partition_keys()
+        self._partitions: Dict[PartitionKey, FlowerPediaView] = {}
+        self._rebuilding: Dict[PartitionKey, threading.Thread] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key: PartitionKey) -> FlowerPediaView:
+        flowerpedia = self._partitions.get(key)
+        if flowerpedia is None:
+            if key not in self._keys:
+                raise KeyError(key)
+            with self._lock:
+                if key not in self._partitions:
+                    self._partitions[key] = self._load(key)
+            flowerpedia = self._partitions[key]
+        return flowerpedia
+
+    def __iter__(self) -> Iterator[PartitionKey]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _load(self, key: PartitionKey) -> FlowerPediaView:
+        file = partition_file(self.db_dir, key)
+        if path.isfile(file):
+            with open(file, "rb") as fp:
+                flowerpedia, up_to_date = decode_partition(fp.read(), key[0])
+            if not up_to_date:
+                self._rebuild_in_background(key)
+            return flowerpedia.view()
+
+        flowerpedia = build_partition(key, partition_base_flowers(key))
+        os.makedirs(self.db_dir, exist_ok=True)
+        write_partition(self.db_dir, key, flowerpedia, source_hash())
+        return flowerpedia.view()
+
+    def _rebuild_in_background(self, key: PartitionKey):
+        if key in self._rebuilding and self._rebuilding[key].is_alive():
+            return
+
+        def rebuild():
+            flowerpedia = build_partition(key, partition_base_flowers(key))
+            write_partition(self.db_dir, key, flowerpedia, source_hash())
+            self._partitions[key] = flowerpedia.view()
+
+        self._rebuilding[key] = threading.Thread(target=rebuild, name=f"rebuild {key}", daemon=True)
+        self._rebuilding[key].start()
+
+    def wait(self):
+        """
+        Wait for background regenerations to be over.
+        """
+        for thread in list(self._rebuilding.values()):
+            thread.join()
+
+
+def load_partition(db_dir: str, key: PartitionKey) -> IndexedPedia:
+    """
+    Up to date partition, computed and written when its file is missing or stale.
+    """
+    file = partition_file(db_dir, key)
+    if path.isfile(file):
+        with open(file, "rb") as fp:
+            flowerpedia, up_to_date = decode_partition(fp.read(), key[0])
+        if up_to_date:
+            return flowerpedia
+
+    flowerpedia = build_partition(key, partition_base_flowers(key))
+    os.makedirs(db_dir, exist_ok=True)
+    write_partition(db_dir, key, flowerpedia, source_hash())
+    return flowerpedia
+
+
+def encode_map(partitions: Dict[PartitionKey, IndexedPedia], digest: bytes) -> bytes:
+    offset = MAP_HEADER.size + len(partitions) * MAP_DIRECTORY.size
+    directory = []
+    blocks = []
+    for (flower_type, seed, island), p in partitions.items():
+        rows = array(p.species.typecode, [p.species.none]) * p.species.size
+        for row, f in enumerate(p.order):
+            rows[f] = row
+        block = p.order.tobytes() + rows.tobytes() + encode_partition(p, digest)[HEADER.size :]
+        directory.append(MAP_DIRECTORY.pack(Flower.flowertypes.index(flower_type), seed, island, len(p), offset))
+        blocks.append(block)
+        offset += len(block)
+
+    header = MAP_HEADER.pack(MAP_MAGIC, FORMAT_VERSION, ALGORITHM_VERSION, digest, len(partitions))
+    return b"".join([header] + directory + blocks)
+
+
+def write_map(db_dir: str) -> str:
+    """
+    Write the mapped layout of every partition, from the partition files. Atomic, like
+    `write_partition`: processes which mapped the previous file keep reading it.
+    """
+    partitions = {key: load_partition(db_dir, key) for key in db_partition_keys()}
+    file = path.join(db_dir, MAP_FILE)
+    tmp = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as fp:
+        fp.write(encode_map(partitions, source_hash()))
+    os.replace(tmp, file)
+    return file
+
+
+class MappedPedia(Mapping[int, Entry]):
+    """
+    Read-only `IndexedPedia` of one partition of the mapped layout, records are decoded on access.
+    """
+
+    __slots__ = ("species", "order", "_rows", "_buffer", "_records", "_record")
+
+    def __init__(self, sp: Species, buffer: memoryview, offset: int, n_entries: int):
+        self.species = sp
+        item = array(sp.typecode).itemsize
+        rows = offset + n_entries * item
+        self.order = buffer[offset:rows].cast(sp.typecode)
+        self._rows = buffer[rows : rows + sp.size * item].cast(sp.typecode)
+        self._buffer = buffer
+        self._records = rows + sp.size * item
+        self._record = record_struct(sp)
+
+    def __getitem__(self, f: int) -> Entry:
+        if f not in self:
+            raise KeyError(f)
+        record = self._record
+        values = record.unpack_from(self._buffer, self._records + self._rows[f] * record.size)
+        return decode_record(self.species, values)[1]
+
+    def __contains__(self, f) -> bool:
+        return isinstance(f, int) and 0 <= f < len(self._rows) and self._rows[f] != self.species.none
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.order)
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def subset(self, genotypes: Iterable[int]) -> IndexedPedia:
+        res = IndexedPedia(self.species)
+        for f in genotypes:
+            res.copy_entry(self, f)
+        return res
+
+    def view(self) -> FlowerPediaView:
+        return FlowerPediaView(self)
+
+
+class MappedFlowerPediaDB(Mapping[PartitionKey, Mapping[Flower, AncestorInfo]]):
+    """
+    {(type, seed, island): FlowerPedia view} over the memory-mapped `MAP_FILE`.
+    """
+
+    def __init__(self, file: str):
+        with open(file, "rb") as fp:
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+
+        magic, fmt, algorithm, digest, n_partitions = MAP_HEADER.unpack_from(buffer)
+        if magic != MAP_MAGIC or fmt != FORMAT_VERSION:
+            raise ValueError(f"Unsupported FlowerPedia map format ({magic!r}, version {fmt}).")
+        self.up_to_date = algorithm == ALGORITHM_VERSION and digest == source_hash()
+
+        self._partitions: Dict[PartitionKey, FlowerPediaView] = {}
+        for i in range(n_partitions):
+            entry = MAP_HEADER.size + i * MAP_DIRECTORY.size
+            t, seed, island, n_entries, offset = MAP_DIRECTORY.unpack_from(buffer, entry)
+            flower_type = Flower.flowertypes[t]
+            pedia = MappedPedia(genotype.species(flower_type), buffer, offset, n_entries)
+            self._partitions[(flower_type, bool(seed), bool(island))] = pedia.view()
+
+    def __getitem__(self, key: PartitionKey) -> FlowerPediaView:
+        return self._partitions[key]
+
+    def __iter__(self) -> Iterator[PartitionKey]:
+        return iter(self._partitions)
+
+    def __len__(self) -> int:
+        return len(self._partitions)
+
+
+def open_db(db_dir: str, mapped: bool = True) -> Mapping[PartitionKey, Mapping[Flower, AncestorInfo]]:
+    """
+    The mapped layout when `mapped` and it is up to date, the partition files otherwise.
+    """
+    file = path.join(db_dir, MAP_FILE)
+    if mapped and path.isfile(file):
+        db = MappedFlowerPediaDB(file)
+        if db.up_to_date and list(db) == db_partition_keys():
+            return db
+    return FlowerPediaDB(db_dir)
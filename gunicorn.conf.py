@@ -0,0 +1,14 @@
+"""
+gunicorn configuration: `gunicorn acnh_flower:app`
+
+The app is imported and its data preloaded in the master, workers then share these
+pages copy-on-write instead of each loading its own copy.
+"""
+
+import os
+
+os.environ.setdefault("FLOWER_PRELOAD", "1")
+# Uncomment to render every valid /results query before forking.
+# os.environ.setdefault("FLOWER_WARM_CACHE", "1")
+
+preload_app = True
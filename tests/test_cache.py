@@ -0,0 +1,109 @@
+import threading
+import time
+
+from app.cache import LRUCache
+
+
+def wait_for(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache("test", maxsize=2)
+    cache.get_or_compute("a", lambda: 1)
+    cache.get_or_compute("b", lambda: 2)
+    cache.get_or_compute("a", lambda: 0)  # Hit: "b" becomes the oldest.
+    cache.get_or_compute("c", lambda: 3)
+
+    assert len(cache) == 2
+    assert cache.get_or_compute("a", lambda: 0) == 1
+    assert cache.get_or_compute("b", lambda: 20) == 20
+    assert cache.stats()["hits"] == 2
+
+
+def test_byte_accounting():
+    cache = LRUCache("test", maxsize=10, maxbytes=10, sizeof=len)
+    cache.get_or_compute("a", lambda: "aaaa")
+    cache.get_or_compute("b", lambda: "bbbb")
+    assert cache.nbytes == 8
+
+    # 12 bytes: "a" is evicted, and only "a".
+    cache.get_or_compute("c", lambda: "cccc")
+    assert cache.nbytes == 8
+    assert cache.stats()["size"] == 2
+    assert cache.get_or_compute("b", lambda: "") == "bbbb"
+
+    # Larger than maxbytes on its own: evicts everything, itself included.
+    assert cache.get_or_compute("d", lambda: "d" * 11) == "d" * 11
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+    cache.get_or_compute("e", lambda: "ee")
+    cache.clear()
+    assert cache.nbytes == 0
+    assert len(cache) == 0
+
+
+def test_concurrent_misses_are_coalesced():
+    cache = LRUCache("test")
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "value"
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute)))
+    first.start()
+    assert started.wait(5)
+
+    waiters = [threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute))) for _ in range(3)]
+    for t in waiters:
+        t.start()
+    wait_for(lambda: cache.stats()["coalesced"] == 3)
+    release.set()
+    for t in [first] + waiters:
+        t.join(5)
+
+    assert results == ["value"] * 4
+    assert len(calls) == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["coalesced"] == 3
+
+
+def test_errors_reach_waiters_and_are_not_cached():
+    cache = LRUCache("test")
+    started, release = threading.Event(), threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError("boom")
+
+    errors = []
+
+    def call():
+        try:
+            cache.get_or_compute("k", fail)
+        except ValueError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    assert started.wait(5)
+    threads.append(threading.Thread(target=call))
+    threads[1].start()
+    wait_for(lambda: cache.stats()["coalesced"] == 1)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert errors == ["boom", "boom"]
+    assert len(cache) == 0
+    assert cache.get_or_compute("k", lambda: "ok") == "ok"
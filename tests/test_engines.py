@@ -0,0 +1,39 @@
+import pytest
+
+from flower import genotype, main
+from flower.engines import differences, engines, queries, query_differences
+
+PARTITIONS = list(main.db_partitions())
+
+
+@pytest.fixture(scope="module")
+def references():
+    """
+    Reference FlowerPedia of each partition, explored once for every engine.
+    """
+    cache = {}
+
+    def reference(key, base_flowers):
+        if key not in cache:
+            cache[key] = main.explore(base_flowers)
+        return cache[key]
+
+    return reference
+
+
+@pytest.mark.parametrize("engine", sorted(engines()))
+@pytest.mark.parametrize("key, base_flowers", PARTITIONS, ids=[str(key) for key, _ in PARTITIONS])
+def test_engine_matches_reference(references, engine, key, base_flowers):
+    reference = references(key, base_flowers)
+    flowerpedia = engines()[engine](base_flowers)
+    assert differences(reference, flowerpedia) == []
+
+
+@pytest.mark.parametrize("stop_at_first", [False, True])
+@pytest.mark.parametrize("key, base_flowers", PARTITIONS, ids=[str(key) for key, _ in PARTITIONS])
+def test_target_queries_match_reference(references, stop_at_first, key, base_flowers):
+    reference = references(key, base_flowers)
+    for color, targets in queries(key[0]):
+        flowerpedia = genotype.search(base_flowers, targets, stop_at_first)
+        assert query_differences(reference, flowerpedia, targets, stop_at_first) == [], color
+
@@ -0,0 +1,114 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from app import app, routes
+from app.jobs import JobQueue
+
+
+# Job handlers run in the process pool: module level, so that they can be pickled.
+def double(x):
+    return 2 * x
+
+
+def fail_unless(file):
+    if not os.path.exists(file):
+        raise ValueError("missing file")
+    return "ok"
+
+
+def die():
+    os._exit(1)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), {"double": double, "fail_unless": fail_unless, "die": die}, 1)
+
+
+def wait(queue, job_id, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        status = queue.status(job_id)
+        if status["status"] != "pending" or time.monotonic() > deadline:
+            return status
+        time.sleep(0.02)
+
+
+def test_done(queue):
+    job_id = queue.submit(["double", 21], "double", {"x": 21})
+    assert queue.status(job_id)["status"] in ("pending", "done")
+    assert wait(queue, job_id)["status"] == "done"
+    assert queue.result(job_id) == 42
+
+    # Done jobs are not submitted again.
+    assert queue.submit(["double", 21], "double", {"x": 21}) == job_id
+    assert queue.stats() == {"pending": 0, "done": 1, "failed": 0, "running": 0}
+
+
+def test_failed_job_is_retried(queue, tmp_path):
+    file = str(tmp_path / "flag")
+    job_id = queue.submit(["fail"], "fail_unless", {"file": file})
+    status = wait(queue, job_id)
+    assert status["status"] == "failed"
+    assert status["error"] == "missing file"
+    with pytest.raises(KeyError):
+        queue.result(job_id)
+
+    open(file, "w").close()
+    assert queue.submit(["fail"], "fail_unless", {"file": file}) == job_id
+    status = wait(queue, job_id)
+    assert status["status"] == "done"
+    assert status["error"] is None
+    assert queue.result(job_id) == "ok"
+
+
+def test_lost_job_is_claimed_again(queue):
+    # A pending job owned by a process which is gone.
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    job_id = queue.job_id(["lost"])
+    with queue._connect() as db:
+        db.execute(
+            "INSERT INTO jobs (id, kind, args, status, owner, created) VALUES (?, 'double', '{\"x\": 4}', 'pending', ?, ?)",
+            (job_id, dead.pid, time.time()),
+        )
+
+    assert wait(queue, job_id)["status"] == "done"
+    assert queue.result(job_id) == 8
+
+
+def test_broken_pool_is_replaced(queue):
+    status = wait(queue, queue.submit(["die"], "die", {}))
+    assert status["status"] == "failed"
+
+    job_id = queue.submit(["double", 1], "double", {"x": 1})
+    assert wait(queue, job_id)["status"] == "done"
+    assert queue.result(job_id) == 2
+
+
+def test_api_jobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(routes, "_job_queue", JobQueue(str(tmp_path / "jobs.sqlite3"), {"plan": routes.run_plan_job}, 1))
+    client = app.test_client()
+
+    target = {"type": "roses", "color": "blue", "seed": True, "owned": ["Rr Yy ww Ss"]}
+    r = client.post("/api/jobs", json=target)
+    assert r.status_code == 202
+    location = r.headers["Location"]
+
+    # Same target, other spelling: same job.
+    r = client.post("/api/jobs", json=dict(target, owned=["rRyYwwsS"]))
+    assert r.headers["Location"] == location
+
+    deadline = time.monotonic() + 60
+    while client.get(location).get_json()["status"] == "pending" and time.monotonic() < deadline:
+        time.sleep(0.05)
+    r = client.get(f"{location}/result")
+    assert r.status_code == 200
+    assert r.get_json()["color"] == "Blue"
+
+    assert client.get("/api/jobs/unknown").status_code == 404
+    assert client.post("/api/jobs", json=dict(target, seed="true")).status_code == 400
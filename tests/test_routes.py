@@ -0,0 +1,120 @@
+import pytest
+
+from app import app, routes
+
+BLUE_ROSES = "/results?tgt_type=ROSES&tgt_color=Blue&seed=on"
+
+
+@pytest.fixture
+def client():
+    routes.results_cache.clear()
+    routes.plans_cache.clear()
+    return app.test_client()
+
+
+def test_results_etag(client):
+    r = client.get(BLUE_ROSES)
+    assert r.status_code == 200
+    assert r.mimetype == "text/html"
+    etag = r.headers["ETag"]
+
+    r = client.get(BLUE_ROSES, headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.data == b""
+    assert routes.results_cache.stats()["hits"] == 1
+
+    r = client.get(BLUE_ROSES, headers={"Accept": "application/json", "If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.get_json()["color"] == "Blue"
+    assert r.headers["ETag"] != etag
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "tgt_type=ROSES&tgt_color=Nope&seed=on",
+        "tgt_type=Blue&tgt_color=ROSES&seed=on",
+        "tgt_type=ROSES&tgt_color=Blue&seed=on&plans=0",
+        "tgt_type=ROSES&tgt_color=Blue&seed=on&owned=RR",
+        "tgt_type=ROSES&tgt_color=Green",
+    ],
+)
+def test_results_errors_are_not_cached(client, query):
+    r = client.get(f"/results?{query}")
+    assert r.status_code == 400
+    r = client.get(f"/results?{query}", headers={"Accept": "application/json"})
+    assert r.status_code == 400
+    assert "error" in r.get_json()
+    assert len(routes.results_cache) == len(routes.plans_cache) == 0
+
+
+def test_cross(client):
+    r = client.post("/api/cross", json={"type": "roses", "pairs": [["RR yy WW ss", "rr YY WW ss"], ["0200", [2, 0, 0, 0]]]})
+    assert r.status_code == 200
+    pairs = r.get_json()["pairs"]
+    assert len(pairs) == 2
+    for pair in pairs:
+        assert sum(pair["colors"].values()) == pytest.approx(1.0)
+        assert sum(child["prob"] for child in pair["offspring"]) == pytest.approx(1.0)
+
+    r = client.post("/api/cross", json={"type": "roses", "pairs": [["2000", "0200"]], "offspring": False})
+    assert "offspring" not in r.get_json()["pairs"][0]
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        [],
+        {"type": "blue", "pairs": [["2000", "0200"]]},
+        {"type": "roses"},
+        {"type": "roses", "pairs": []},
+        {"type": "roses", "pairs": [["2000"]]},
+        {"type": "roses", "pairs": [["2000", "0300"]]},
+        {"type": "roses", "pairs": [["2000", [[2], 0, 0, 0]]]},
+        {"type": "roses", "pairs": [["2000", "RR YY"]]},
+        {"type": "roses", "pairs": [["2000", "0200"]], "offspring": "false"},
+    ],
+)
+def test_cross_validation(client, body):
+    r = client.post("/api/cross", json=body)
+    assert r.status_code == 400
+    assert "error" in r.get_json()
+
+
+def test_simulate(client):
+    body = {"type": "roses", "color": "blue", "seed": True, "trials": 1000, "random_seed": 0, "percentiles": [50, 90]}
+    r = client.post("/api/simulate", json=body)
+    assert r.status_code == 200
+    assert r.get_json()["random_seed"] == 0
+    assert client.post("/api/simulate", json=body).get_json() == r.get_json()
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        {"type": "daisies"},
+        {"color": "nope"},
+        {"seed": "false"},
+        {"island": 1},
+        {"trials": 0},
+        {"trials": "1000"},
+        {"random_seed": -1},
+        {"percentiles": [0]},
+        {"percentiles": "50"},
+        {"owned": "RR yy WW ss"},
+    ],
+)
+def test_simulate_validation(client, change):
+    body = dict({"type": "roses", "color": "blue", "trials": 1000}, **change)
+    r = client.post("/api/simulate", json=body)
+    assert r.status_code == 400
+    assert "error" in r.get_json()
+
+
+def test_plan_flags(client):
+    r = client.post("/api/plan", json={"seed": "0", "targets": [{"type": "roses", "color": "blue"}]})
+    assert r.status_code == 400
+
+    r = client.post("/api/plan", json={"targets": [{"type": "roses", "color": "blue", "island": "false"}]})
+    assert r.status_code == 200
+    assert "error" in r.get_json()["plans"][0]